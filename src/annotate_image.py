@@ -1,41 +1,145 @@
 import cv2
 import os
-from typing import List, Dict, Tuple, Optional # Optional for Python < 3.10
+import shutil
+import bisect
+import functools
+import mmap
+from collections import defaultdict
+import numpy as np
+from typing import List, Dict, Tuple, Optional, Union # Optional for Python < 3.10
 # from PIL import Image, ImageDraw, ImageFont # PIL can be better for complex text, but let's stick to cv2 for now if possible
 
 # MAX_BIO_LINES = 4 # Limit number of bio lines to display to prevent huge text blocks - REMOVED
 
+# Annotated images are previews, so favor encode speed over file size
+PNG_COMPRESSION_LEVEL = 1 # zlib level; OpenCV's default is 3
+JPEG_QUALITY = 85
+# Cell size (px) of the grid that indexes placed text blocks for overlap queries
+OCCUPIED_GRID_CELL_SIZE = 64
+
+@functools.lru_cache(maxsize=4096)
+def _text_size(text: str, font: int, font_scale: float, font_thickness: int) -> Tuple[int, int]:
+    """Memoized cv2.getTextSize; returns (width, height) of the text, baseline dropped."""
+    return cv2.getTextSize(text, font, font_scale, font_thickness)[0]
+
+@functools.lru_cache(maxsize=32)
+def _sample_line_height(font: int, font_scale: float, font_thickness: int) -> int:
+    """Height of a line with an ascender and a descender, used as the line pitch for text blocks."""
+    return cv2.getTextSize("Tg", font, font_scale, font_thickness)[0][1]
+
+# Band upper edges (inclusive) and their BGR colors: Red (<= 0.33), Yellow (<= 0.66), Green (above)
+_RELEVANCE_BAND_EDGES = (0.33, 0.66)
+_RELEVANCE_BAND_COLORS = (
+    (0, 0, 255), # Pure Red for low scores
+    (0, 255, 255), # Pure Yellow for medium scores
+    (0, 255, 0), # Pure Green for high scores
+)
+
 def get_color_for_relevance(score: float) -> Tuple[int, int, int]:
     """Returns a BGR color based on the relevance score (0.0 to 1.0).
-       Gradient: Red (low) -> Yellow (mid) -> Green (high).
+       Bands: Red (low) -> Yellow (mid) -> Green (high).
     """
     # Ensure score is clamped between 0 and 1
     score = max(0.0, min(1.0, score))
-
-    if score <= 0.33:
-        # Transition from Red to Yellow (Red at 0, Yellow towards 0.33)
-        # For simplicity, let's use pure Red for the first third
-        # r = 255
-        # g = int(255 * (score / 0.33)) 
-        # b = 0
-        # return (b, g, r) # BGR
-        return (0,0,255) # Pure Red for low scores
-    elif score <= 0.66:
-        # Transition from Yellow to Green (Yellow at 0.33, Green towards 0.66)
-        # For simplicity, let's use pure Yellow for the middle third
-        # r = int(255 * (1 - (score - 0.33) / 0.33))
-        # g = 255
-        # b = 0
-        # return (b, g, r) # BGR
-        return (0, 255, 255) # Pure Yellow for medium scores
-    else:
-        # Transition towards Green (Green at 0.66 and above)
-        # For simplicity, let's use pure Green for high scores
-        # r = 0
-        # g = 255
-        # b = int(255 * ((score - 0.66) / 0.34)) # scale to blue for a cyan-like green, or keep 0 for pure green
-        # return (b, g, r) # BGR
-        return (0, 255, 0) # Pure Green for high scores
+    # bisect_left keeps each edge inside the lower band, exactly like the <= comparisons
+    return _RELEVANCE_BAND_COLORS[bisect.bisect_left(_RELEVANCE_BAND_EDGES, score)]
+
+@functools.lru_cache(maxsize=32)
+def _glyph_advances(font: int, font_scale: float, font_thickness: int) -> Optional[Tuple[np.ndarray, int]]:
+    """Per-character advance widths for printable ASCII, indexed by byte value, plus the
+    constant per-line overhead, so that width(line) == overhead + sum(advances[c] for c in line).
+    Non-printable entries are -1. Returns None if this OpenCV build does not measure text additively.
+    """
+    advances = np.full(128, -1, dtype=np.int32)
+    overheads = set()
+    for code in range(32, 127):
+        ch = chr(code)
+        single_w = cv2.getTextSize(ch, font, font_scale, font_thickness)[0][0]
+        double_w = cv2.getTextSize(ch + ch, font, font_scale, font_thickness)[0][0]
+        advances[code] = double_w - single_w
+        overheads.add(single_w - advances[code])
+    if len(overheads) != 1 or advances[32:127].min() <= 0: # Wrapping relies on every glyph having width
+        return None
+    overhead = overheads.pop()
+    # Hershey glyphs have no kerning, but older OpenCV rounds the summed width instead of
+    # each glyph; check the model on a mixed probe before trusting it.
+    probe = "Bio: The quick brown fox jumps over the lazy dog, 0123456789 (MWil.)"
+    probe_w = cv2.getTextSize(probe, font, font_scale, font_thickness)[0][0]
+    if overhead + int(advances[np.frombuffer(probe.encode("ascii"), np.uint8)].sum()) != probe_w:
+        return None
+    return advances, overhead
+
+def _wrap_bio_exact(bio: str, font: int, font_scale: float, font_thickness: int, text_block_max_width: int) -> List[str]:
+    """Greedy word wrap of 'Bio: <bio>' measuring every candidate line with getTextSize."""
+    lines = []
+    current_bio_line = "Bio:"
+    for word in bio.split(' '):
+        test_line = f"{current_bio_line} {word}".strip()
+        line_w, _ = _text_size(test_line, font, font_scale, font_thickness)
+        if line_w > text_block_max_width and current_bio_line != "Bio:":
+            lines.append(current_bio_line)
+            current_bio_line = word
+        else:
+            current_bio_line = test_line
+    if current_bio_line:
+        lines.append(current_bio_line)
+    return lines
+
+def _wrap(word_widths: List[int], space_w: int, head_w: int, max_w: int) -> Tuple[List[int], List[int]]:
+    """Greedy wrap over integer advance widths, mirroring _wrap_bio_exact. Empty words (from
+    repeated spaces) have width 0. Returns (breaks, line_widths): line k holds the words
+    words[breaks[k]:breaks[k+1]], the first line following the head ("Bio:").
+    """
+    breaks = [0]
+    line_widths = []
+    current_w = head_w
+    at_head = True # Nothing appended after the head yet, so it is never wrapped on its own
+    for i, word_w in enumerate(word_widths):
+        test_w = current_w + space_w + word_w if current_w and word_w else current_w + word_w
+        if test_w > max_w and not at_head:
+            breaks.append(i)
+            line_widths.append(current_w)
+            current_w = word_w
+        elif word_w:
+            current_w = test_w
+            at_head = False
+    if current_w: # An all-empty trailing line is dropped
+        breaks.append(len(word_widths))
+        line_widths.append(current_w)
+    return breaks, line_widths
+
+def _wrap_bio(bio: str, font: int, font_scale: float, font_thickness: int, text_block_max_width: int) -> List[str]:
+    """Greedy word wrap of 'Bio: <bio>' into lines no wider than text_block_max_width.
+    Uses summed glyph advances instead of measuring each candidate line, and only calls
+    getTextSize once per finished line to confirm it. Same line breaks as _wrap_bio_exact.
+    """
+    glyphs = _glyph_advances(font, font_scale, font_thickness)
+    if glyphs is None or not bio.isascii():
+        return _wrap_bio_exact(bio, font, font_scale, font_thickness, text_block_max_width)
+    advances, overhead = glyphs
+
+    text = "Bio: " + bio
+    char_widths = advances[np.frombuffer(text.encode("ascii"), np.uint8)]
+    words = bio.split(' ')
+    # Tabs/newlines etc. are not in the table; a wrapped line starting with "Bio:" would also
+    # be treated as the head by the exact wrap
+    if (char_widths < 0).any() or "Bio:" in words:
+        return _wrap_bio_exact(bio, font, font_scale, font_thickness, text_block_max_width)
+
+    # Per-word advance sums via prefix sums over the whole text; words are separated by single spaces
+    prefix = np.concatenate(([0], np.cumsum(char_widths)))
+    bounds = np.cumsum([5] + [len(w) + 1 for w in words]) # "Bio: " is 5 chars
+    word_widths = (prefix[bounds[1:] - 1] - prefix[bounds[:-1]]).tolist()
+    breaks, line_raws = _wrap(word_widths, int(advances[ord(' ')]), int(prefix[4]), text_block_max_width - overhead)
+    lines = [" ".join(filter(None, words[a:b])) for a, b in zip(breaks, breaks[1:])]
+    lines[0] = f"Bio: {lines[0]}" if lines[0] else "Bio:"
+
+    # Confirm the finished lines; the results also warm the cache used for block dimensions
+    for line, line_raw in zip(lines, line_raws):
+        expected_w = overhead + line_raw if line else 0
+        if _text_size(line, font, font_scale, font_thickness)[0] != expected_w:
+            return _wrap_bio_exact(bio, font, font_scale, font_thickness, text_block_max_width)
+    return lines
 
 def draw_multiline_text_with_background(
     image, 
@@ -46,26 +150,23 @@ def draw_multiline_text_with_background(
     font_color: Tuple[int, int, int], 
     font_thickness: int, 
     bg_color: Tuple[int, int, int],
-    text_block_max_width: int # Max width for the text block background
+    text_block_max_width: int, # Max width for the text block background
+    precomputed: Optional[Tuple[int, int]] = None # (bg_width, bg_height) from measure_text_block
     ) -> Tuple[int, int, int, int]: # Returns (x1, y1, x2, y2) of the drawn block
-    """Draws multiple lines of text with a single background rectangle. Returns bounding box of the drawn area."""
+    """Draws multiple lines of text with a single background rectangle. Returns bounding box of the drawn area.
+    Pass precomputed block size from measure_text_block to skip re-measuring the lines.
+    """
     x, y = position
-    line_height_with_spacing = 0
-    actual_max_line_width = 0
 
     if not text_lines:
         return (x,y,x,y) # No text, no area
 
-    sample_line_height = cv2.getTextSize("Tg", font, font_scale, font_thickness)[0][1]
+    sample_line_height = _sample_line_height(font, font_scale, font_thickness)
     line_height_with_spacing = sample_line_height + 5 # 5px spacing between lines
 
-    for i, line in enumerate(text_lines):
-        (line_w, line_h), _ = cv2.getTextSize(line, font, font_scale, font_thickness)
-        if line_w > actual_max_line_width:
-            actual_max_line_width = line_w
-    
-    bg_width = min(actual_max_line_width, text_block_max_width)
-    bg_height = len(text_lines) * line_height_with_spacing - 5 # -5 to remove trailing space from last line
+    if precomputed is None:
+        precomputed = measure_text_block(text_lines, font, font_scale, font_thickness, text_block_max_width)
+    bg_width, bg_height = precomputed
 
     padding = 5
     bg_x1 = x - padding
@@ -73,7 +174,10 @@ def draw_multiline_text_with_background(
     bg_x2 = x + bg_width + padding
     bg_y2 = y + bg_height + padding
     
-    cv2.rectangle(image, (bg_x1, bg_y1), (bg_x2, bg_y2), bg_color, cv2.FILLED)
+    # Solid fill via a direct slice write instead of cv2.rectangle(..., cv2.FILLED);
+    # the rectangle includes both corners, and is clipped to the image like cv2 does
+    img_h, img_w = image.shape[:2]
+    image[max(0, bg_y1):min(img_h, bg_y2 + 1), max(0, bg_x1):min(img_w, bg_x2 + 1)] = bg_color
 
     current_y = y + sample_line_height # Start y for first line, adjusted for baseline
     for line in text_lines:
@@ -82,29 +186,41 @@ def draw_multiline_text_with_background(
     
     return (bg_x1, bg_y1, bg_x2, bg_y2) # Return actual bounding box of the drawn block
 
-def get_text_block_dimensions(
+def measure_text_block(
     text_lines: List[str],
     font: int,
     font_scale: float,
     font_thickness: int,
     text_block_max_width: int
 ) -> Tuple[int, int]:
-    """Calculates the width and height of a multiline text block with background."""
+    """Calculates the (width, height) of a multiline text block's background, excluding padding."""
     if not text_lines:
         return 0, 0
 
     actual_max_line_width = 0
-    sample_line_height = cv2.getTextSize("Tg", font, font_scale, font_thickness)[0][1]
+    sample_line_height = _sample_line_height(font, font_scale, font_thickness)
     line_height_with_spacing = sample_line_height + 5
 
     for line in text_lines:
-        (line_w, _), _ = cv2.getTextSize(line, font, font_scale, font_thickness)
+        line_w, _ = _text_size(line, font, font_scale, font_thickness)
         if line_w > actual_max_line_width:
             actual_max_line_width = line_w
     
     bg_width = min(actual_max_line_width, text_block_max_width)
     bg_height = len(text_lines) * line_height_with_spacing - 5 # -5 for trailing space
-    
+    return bg_width, bg_height
+
+def get_text_block_dimensions(
+    text_lines: List[str],
+    font: int,
+    font_scale: float,
+    font_thickness: int,
+    text_block_max_width: int
+) -> Tuple[int, int]:
+    """Calculates the width and height of a multiline text block with background."""
+    if not text_lines:
+        return 0, 0
+    bg_width, bg_height = measure_text_block(text_lines, font, font_scale, font_thickness, text_block_max_width)
     padding = 5
     return bg_width + (2 * padding), bg_height + (2 * padding)
 
@@ -118,30 +234,62 @@ def check_overlap(rect1: Tuple[int, int, int, int], rect2: Tuple[int, int, int,
         return False
     return True
 
-def annotate_image(
-    input_image_path: str,
-    output_image_path: str,
-    ranked_profiles: List[Tuple[str, float]], # List of (id, score)
-    all_detections: List[Dict],            # List of {id: str, bbox: (x,y,w,h)}
-    profiles_data: Dict[str, Dict]         # Dict of {id: {name, bio, ...}}
-):
+def _imwrite_params(path: str) -> List[int]:
+    """cv2.imwrite encoder flags for the format implied by path's extension."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION_LEVEL]
+    if ext in (".jpg", ".jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+    return []
+
+def _read_bgr(path: str) -> Optional[np.ndarray]:
+    """Decodes an image file as BGR from a read-only memory map of it, so the encoded bytes
+    come straight from the OS page cache (shared between worker processes) without an extra copy."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None # Empty files cannot be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            encoded = np.frombuffer(mapped, dtype=np.uint8)
+            image = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+            del encoded # Release the buffer export so the map can close
+    return image
+
+@functools.lru_cache(maxsize=8)
+def _load_bgr(path: str, mtime: float) -> Optional[np.ndarray]:
+    """Decodes an image once per (path, mtime); the cached array is read-only, callers draw on a copy."""
+    image = _read_bgr(path)
+    if image is not None:
+        image.flags.writeable = False
+    return image
+
+Detections = Union[List[Dict], Tuple[List[str], np.ndarray]]
+
+def build_detections_map(all_detections: Detections) -> Dict[str, Tuple[int, int, int, int]]:
+    """Indexes detection bboxes by id. Accepts a list of {id, bbox} dicts (entries without an
+    id or bbox are dropped) or detect_qr_codes' (ids, bboxes) arrays.
     """
-    Draws green rectangles and writes "Name (score)" and Bio at each bbox for ranked profiles.
-    Attempts to place text to avoid overlaps.
-    Saves result to output_path.
-    """
-    try:
-        image = cv2.imread(input_image_path)
-        if image is None:
-            print(f"Error: Could not read image from {input_image_path}")
-            return
-    except Exception as e:
-        print(f"Error loading image {input_image_path} with OpenCV: {e}")
-        return
-
+    if isinstance(all_detections, tuple):
+        ids, bboxes = all_detections
+        return dict(zip(ids, map(tuple, np.asarray(bboxes).tolist())))
+    return {det["id"]: det["bbox"] for det in all_detections if "id" in det and "bbox" in det}
+
+def _annotate_np(
+    image: np.ndarray,
+    ranked_profiles: List[Tuple[str, float]],
+    detections_map: Dict[str, Tuple[int, int, int, int]],
+    profiles_data: Dict[str, Dict]
+):
+    """Draws the relevance boxes and text blocks for ranked profiles onto image, in place."""
     img_h, img_w = image.shape[:2]
-    detections_map = {det["id"]: det for det in all_detections if "id" in det and "bbox" in det}
-    occupied_regions: List[Tuple[int, int, int, int]] = [] # List of (x1, y1, x2, y2) for text blocks
+    # Filter to profiles that were actually detected once, instead of per iteration
+    valid_ids = frozenset(detections_map).intersection(pid for pid, _ in ranked_profiles)
+    # (x1, y1, x2, y2) rows for placed text blocks; first num_occupied rows are valid
+    occupied_regions = np.empty((max(len(ranked_profiles), 1), 4), dtype=np.int32)
+    num_occupied = 0
+    # Grid cell (cy, cx) -> indices into occupied_regions of the rects touching that cell
+    occupied_grid: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+    cell = OCCUPIED_GRID_CELL_SIZE
 
     font = cv2.FONT_HERSHEY_SIMPLEX
     font_scale = 0.35
@@ -153,20 +301,11 @@ def annotate_image(
     text_block_max_width = 250 # Slightly increased max width for potentially longer bios
     qr_box_padding = 5 # Padding around QR code for text placement
 
+    # Phase 1: wrap and measure every text block once, before any placement
+    prepared = []
     for profile_id, score in ranked_profiles:
-        if profile_id not in detections_map:
+        if profile_id not in valid_ids:
             continue
-        
-        detection = detections_map[profile_id]
-        bbox = detection["bbox"]
-        qr_x, qr_y, qr_w, qr_h = bbox
-
-        # Draw QR bounding box first, with color based on relevance
-        dynamic_box_color = get_color_for_relevance(score)
-        cv2.rectangle(image, (qr_x, qr_y), (qr_x + qr_w, qr_y + qr_h), dynamic_box_color, box_thickness)
-        # Add QR box to occupied regions to avoid drawing text over it (optional, but good for clarity)
-        # occupied_regions.append((qr_x, qr_y, qr_x + qr_w, qr_y + qr_h))
-
 
         profile_info = profiles_data.get(profile_id)
         name_to_display = profile_info.get("name", profile_id) if profile_info else profile_id
@@ -176,37 +315,30 @@ def annotate_image(
         lines_for_annotation.append(f"Name: {name_to_display}")
         lines_for_annotation.append(f"Score: {score:.2f}")
         
-        bio_words = bio_to_display.split(' ')
-        current_bio_line = "Bio:"
-        bio_line_count = 0
-        for word in bio_words:
-            # REMOVED: MAX_BIO_LINES check here, we display full bio
-            # if bio_line_count >= MAX_BIO_LINES: 
-            #     if not current_bio_line.endswith("..."):
-            #         current_bio_line = current_bio_line.rstrip() + "..."
-            #     break 
-            
-            test_line = f"{current_bio_line} {word}".strip()
-            (line_w, _), _ = cv2.getTextSize(test_line, font, font_scale, font_thickness)
-            
-            if line_w > text_block_max_width and current_bio_line != "Bio:":
-                lines_for_annotation.append(current_bio_line)
-                current_bio_line = word
-                # bio_line_count += 1 # No longer strictly tracking for MAX_BIO_LINES
-                # REMOVED: MAX_BIO_LINES check during word addition
-                # if bio_line_count >= MAX_BIO_LINES and word:
-                #      current_bio_line = word[:text_block_max_width//10] + "..." 
-                #      break
-            else:
-                current_bio_line = test_line
-        
-        if current_bio_line:
-            lines_for_annotation.append(current_bio_line)
+        lines_for_annotation.extend(
+            _wrap_bio(bio_to_display, font, font_scale, font_thickness, text_block_max_width)
+        )
 
-        # Calculate expected dimensions of the text block
-        text_w, text_h = get_text_block_dimensions(lines_for_annotation, font, font_scale, font_thickness, text_block_max_width)
-        
-        if text_w == 0 or text_h == 0: continue # No text to draw
+        block_size = measure_text_block(lines_for_annotation, font, font_scale, font_thickness, text_block_max_width)
+        prepared.append((score, detections_map[profile_id], lines_for_annotation, block_size))
+
+    # Place annotations for the largest QR codes first (stable, so rank order breaks ties);
+    # as in 2D bin packing, big items placed early leave fewer overlaps and fallbacks for the rest
+    prepared.sort(key=lambda item: -(item[1][2] * item[1][3]))
+
+    # Phase 2: place and draw; placement depends on previously drawn blocks
+    for score, bbox, lines_for_annotation, block_size in prepared:
+        qr_x, qr_y, qr_w, qr_h = bbox
+
+        # Draw QR bounding box first, with color based on relevance
+        dynamic_box_color = get_color_for_relevance(score)
+        cv2.rectangle(image, (qr_x, qr_y), (qr_x + qr_w, qr_y + qr_h), dynamic_box_color, box_thickness)
+        # Add QR box to occupied regions to avoid drawing text over it (optional, but good for clarity)
+        # occupied_regions.append((qr_x, qr_y, qr_x + qr_w, qr_y + qr_h))
+
+        if not lines_for_annotation: continue # No text to draw
+        # Expected dimensions of the text block including background padding
+        text_w, text_h = block_size[0] + 10, block_size[1] + 10
 
         # Candidate positions (relative to QR code)
         # Order of preference: Right, Left, Below, Above
@@ -221,32 +353,37 @@ def annotate_image(
         
         best_pos: Optional[Tuple[int, int]] = None
 
-        for cand_x, cand_y in candidate_positions:
-            # Ensure candidate position is within image boundaries
-            # Adjust for text block starting point (top-left of background)
-            # The draw_multiline_text_with_background uses (x,y) as the start for actual text,
-            # background is drawn with padding around it.
-            # For collision, we need the background's bounding box.
-            padding_for_bg = 5 # from draw_multiline_text_with_background
-            cand_bg_x1 = cand_x - padding_for_bg
-            cand_bg_y1 = cand_y - padding_for_bg
-            cand_bg_x2 = cand_x + text_w - padding_for_bg # text_w already includes 2*padding
-            cand_bg_y2 = cand_y + text_h - padding_for_bg # text_h already includes 2*padding
-
-
-            if cand_bg_x1 < 0 or cand_bg_y1 < 0 or cand_bg_x2 > img_w or cand_bg_y2 > img_h:
-                continue # Out of bounds
-
-            candidate_rect = (cand_bg_x1, cand_bg_y1, cand_bg_x2, cand_bg_y2)
-            is_overlapping = False
-            for occupied_rect in occupied_regions:
-                if check_overlap(candidate_rect, occupied_rect):
-                    is_overlapping = True
-                    break
-            
-            if not is_overlapping:
-                best_pos = (cand_x, cand_y)
-                break
+        # Background rects for all candidates at once, shape (6, 4) as (x1, y1, x2, y2).
+        # draw_multiline_text_with_background uses (x,y) as the start for actual text,
+        # the background is drawn with padding around it; collisions use the background box.
+        padding_for_bg = 5 # from draw_multiline_text_with_background
+        cand_xy = np.array(candidate_positions, dtype=np.int32)
+        cand_rects = np.empty((len(candidate_positions), 4), dtype=np.int32)
+        cand_rects[:, 0] = cand_xy[:, 0] - padding_for_bg
+        cand_rects[:, 1] = cand_xy[:, 1] - padding_for_bg
+        cand_rects[:, 2] = cand_xy[:, 0] + text_w - padding_for_bg # text_w already includes 2*padding
+        cand_rects[:, 3] = cand_xy[:, 1] + text_h - padding_for_bg # text_h already includes 2*padding
+
+        in_bounds = (cand_rects[:, 0] >= 0) & (cand_rects[:, 1] >= 0) & \
+                    (cand_rects[:, 2] <= img_w) & (cand_rects[:, 3] <= img_h)
+
+        # Only rects sharing a grid cell with an in-bounds candidate can overlap it
+        nearby = set()
+        for x1, y1, x2, y2 in cand_rects[in_bounds].tolist():
+            for cy in range(y1 // cell, y2 // cell + 1):
+                for cx in range(x1 // cell, x2 // cell + 1):
+                    nearby.update(occupied_grid.get((cy, cx), ()))
+
+        # (6, k) overlap matrix against the nearby occupied rects, same predicate as check_overlap
+        occupied = occupied_regions[sorted(nearby)]
+        overlaps = ~((cand_rects[:, None, 0] >= occupied[None, :, 2]) |
+                     (cand_rects[:, None, 2] <= occupied[None, :, 0]) |
+                     (cand_rects[:, None, 1] >= occupied[None, :, 3]) |
+                     (cand_rects[:, None, 3] <= occupied[None, :, 1]))
+        free = in_bounds & ~overlaps.any(axis=1)
+        if free.any():
+            first_free = int(np.argmax(free))
+            best_pos = (int(cand_xy[first_free, 0]), int(cand_xy[first_free, 1]))
         
         # Fallback if no non-overlapping position is found
         if best_pos is None:
@@ -281,15 +418,75 @@ def annotate_image(
         drawn_rect = draw_multiline_text_with_background(
             image, lines_for_annotation, (final_text_x, final_text_y),
             font, font_scale, font_color, font_thickness, 
-            text_bg_color, text_block_max_width
+            text_bg_color, text_block_max_width, precomputed=block_size
         )
-        occupied_regions.append(drawn_rect)
+        occupied_regions[num_occupied] = drawn_rect
+        x1, y1, x2, y2 = drawn_rect
+        for cy in range(y1 // cell, y2 // cell + 1):
+            for cx in range(x1 // cell, x2 // cell + 1):
+                occupied_grid[(cy, cx)].append(num_occupied)
+        num_occupied += 1
+
+def annotate_image(
+    input_image_path: str,
+    output_image_path: str,
+    ranked_profiles: List[Tuple[str, float]], # List of (id, score)
+    all_detections: Detections,            # List of {id: str, bbox: (x,y,w,h)}, or detect_qr_codes' (ids, bboxes)
+    profiles_data: Dict[str, Dict],        # Dict of {id: {name, bio, ...}}
+    image: Optional[np.ndarray] = None,    # Already-decoded BGR image; skips reading input_image_path
+    detections_map: Optional[Dict[str, Tuple[int, int, int, int]]] = None, # Prebuilt build_detections_map(all_detections)
+    output_format: Optional[str] = None    # "png" or "jpg"; replaces the output extension if given
+):
+    """
+    Draws green rectangles and writes "Name (score)" and Bio at each bbox for ranked profiles.
+    Attempts to place text to avoid overlaps.
+    Saves result to output_path.
+    The decoded input is cached per (path, mtime), so annotating the same image repeatedly
+    (e.g. with different rankings) only decodes it once. A passed-in image is never modified.
+    Batch drivers can pass a prebuilt detections_map to avoid re-indexing all_detections.
+    PNGs are written with fast compression; output_format="jpg" writes a JPEG preview instead.
+    If none of the ranked profiles were detected, the input file is copied as-is instead of re-encoded.
+    """
+    if detections_map is None:
+        detections_map = build_detections_map(all_detections)
+    if output_format:
+        output_image_path = f"{os.path.splitext(output_image_path)[0]}.{output_format.lower().lstrip('.')}"
+
+    # Nothing to draw: the output would be identical to the input, so skip decode and encode
+    same_format = os.path.splitext(input_image_path)[1].lower() == os.path.splitext(output_image_path)[1].lower()
+    if image is None and same_format and not any(pid in detections_map for pid, _ in ranked_profiles):
+        if os.path.abspath(input_image_path) == os.path.abspath(output_image_path):
+            return
+        try:
+            output_dir = os.path.dirname(output_image_path)
+            if output_dir and not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+            shutil.copyfile(input_image_path, output_image_path)
+            print(f"No annotations needed; copied {input_image_path} to {output_image_path}")
+        except OSError as e:
+            print(f"Error copying {input_image_path} to {output_image_path}: {e}")
+        return
+
+    if image is None:
+        try:
+            image = _load_bgr(input_image_path, os.path.getmtime(input_image_path))
+            if image is None:
+                print(f"Error: Could not read image from {input_image_path}")
+                return
+        except OSError:
+            print(f"Error: Could not read image from {input_image_path}")
+            return
+        except Exception as e:
+            print(f"Error loading image {input_image_path} with OpenCV: {e}")
+            return
+    image = image.copy()
+    _annotate_np(image, ranked_profiles, detections_map, profiles_data)
 
     try:
         output_dir = os.path.dirname(output_image_path)
         if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir)
-        cv2.imwrite(output_image_path, image)
+        cv2.imwrite(output_image_path, image, _imwrite_params(output_image_path))
         print(f"Annotated image saved to {output_image_path}")
     except Exception as e:
         print(f"Error saving annotated image to {output_image_path}: {e}")
@@ -1,8 +1,13 @@
 import os
 import random
-from PIL import Image, ImageOps # Pillow for image manipulation, ImageOps for padding
+import stat
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import cv2
+import numpy as np
 from src.utils import load_config
-from typing import List, Optional, Tuple
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 # --- Configuration for Sample Image Generation ---
 PHOTOS_DIR = "data/photos/"
@@ -11,7 +16,7 @@ SAMPLE_IMAGES_OUTPUT_DIR_CONFIG_KEY = "SAMPLE_IMAGES_DIR" # Key for output dir f
 
 NEW_CANVAS_WIDTH = 1200
 NEW_CANVAS_HEIGHT = 700
-CANVAS_BG_COLOR = (240, 240, 240) # Light gray for main canvas
+CANVAS_BG_COLOR = (240, 240, 240) # Light gray for main canvas (BGR)
 
 PERSON_PHOTO_SCALE_TO_QR_WIDTH_FACTOR = 2.0 
 QR_DISPLAY_SIZE = (80, 80) # Target display size for QR codes
@@ -21,60 +26,100 @@ MAX_PERSONS_PER_IMAGE = 6
 NUM_SAMPLE_IMAGES_TO_CREATE = 5
 
 MIN_SPACING_BETWEEN_PERSON_UNITS = 30
-MAX_PLACEMENT_ATTEMPTS_PERSON_UNIT = 100
+PLACEMENT_GRID_CELL_SIZE = 8 # Resolution (px) of the occupancy grid used to place person units
+
+@functools.lru_cache(maxsize=16)
+def _scan_asset_dir(asset_dir: str, mtime_ns: int) -> Tuple[str, ...]:
+    """Single os.scandir pass over asset_dir; mtime_ns is part of the cache key so changes are picked up."""
+    supported_extensions = (".jpg", ".jpeg", ".png")
+    with os.scandir(asset_dir) as entries:
+        return tuple(sorted( # Sort for deterministic behavior if needed, though random.sample is used later
+            entry.path
+            for entry in entries
+            if entry.name.lower().endswith(supported_extensions) and entry.is_file()
+        ))
 
 def get_asset_paths(asset_dir: str) -> List[str]:
     """Lists available image files (jpg, png, jpeg) from the specified directory."""
-    if not os.path.isdir(asset_dir):
+    try:
+        dir_stat = os.stat(asset_dir)
+    except OSError:
+        dir_stat = None
+    if dir_stat is None or not stat.S_ISDIR(dir_stat.st_mode):
         print(f"Warning: Asset directory not found: {asset_dir}")
         return []
-    supported_extensions = (".jpg", ".jpeg", ".png")
-    return sorted([ # Sort for deterministic behavior if needed, though random.sample is used later
-        os.path.join(asset_dir, f)
-        for f in os.listdir(asset_dir)
-        if f.lower().endswith(supported_extensions)
-    ])
+    return list(_scan_asset_dir(asset_dir, dir_stat.st_mtime_ns))
+
+def _resize(image: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Resizes to (width, height) with INTER_AREA when shrinking and LANCZOS4 when enlarging."""
+    h, w = image.shape[:2]
+    shrinking = size[0] * size[1] < w * h
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LANCZOS4)
+
+def _mtime_ns(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+@functools.lru_cache(maxsize=256)
+def _load_resized_qr(qr_code_path: str, mtime_ns: int, size: Tuple[int, int]) -> Optional[np.ndarray]:
+    """QR code decoded (keeping alpha, if any) and resized to size; cached read-only, since
+    the same QR codes recur across sample images."""
+    qr_img = cv2.imread(qr_code_path, cv2.IMREAD_UNCHANGED)
+    if qr_img is None:
+        return None
+    qr_img = _resize(qr_img, size)
+    qr_img.flags.writeable = False
+    return qr_img
+
+@functools.lru_cache(maxsize=64)
+def _load_scaled_photo(person_photo_path: str, mtime_ns: int, width: int) -> Optional[np.ndarray]:
+    """Person photo decoded as BGR and scaled to width, keeping its aspect ratio; cached read-only."""
+    person_img = cv2.imread(person_photo_path, cv2.IMREAD_COLOR)
+    if person_img is None:
+        return None
+    person_h_orig, person_w_orig = person_img.shape[:2]
+    aspect_ratio = person_h_orig / person_w_orig
+    scaled = _resize(person_img, (width, int(width * aspect_ratio)))
+    scaled.flags.writeable = False
+    return scaled
 
 def create_person_qr_unit(
     person_photo_path: str, 
     qr_code_path: str, 
     qr_target_display_size: Tuple[int, int],
     scale_factor: float
-    ) -> Optional[Image.Image]:
+    ) -> Optional[np.ndarray]:
     """
     Creates a single visual unit: a person's photo with their QR code overlaid.
     The person's photo is scaled relative to the QR code's width.
     The QR code is placed in the bottom half, horizontally centered.
+    Returns a BGR uint8 array.
     """
-    try:
-        person_img = Image.open(person_photo_path).convert("RGB")
-    except Exception as e:
-        print(f"Error: Could not open person photo {person_photo_path}: {e}")
-        return None
-
-    try:
-        qr_img_raw = Image.open(qr_code_path).convert("RGBA")
-        qr_img_resized = qr_img_raw.resize(qr_target_display_size, Image.Resampling.LANCZOS)
-    except Exception as e:
-        print(f"Error: Could not open or resize QR code {qr_code_path}: {e}")
-        return None
-
     # Scale person photo based on QR code width
     scaled_person_width = int(qr_target_display_size[0] * scale_factor)
-    
-    # Maintain aspect ratio for person photo
-    person_w_orig, person_h_orig = person_img.size
-    aspect_ratio = person_h_orig / person_w_orig
-    scaled_person_height = int(scaled_person_width * aspect_ratio)
 
     try:
-        person_img_scaled = person_img.resize((scaled_person_width, scaled_person_height), Image.Resampling.LANCZOS)
-    except Exception as e:
+        # Copy: the cached photo is shared, the unit canvas gets the QR composited into it
+        person_img_scaled = _load_scaled_photo(person_photo_path, _mtime_ns(person_photo_path), scaled_person_width)
+        if person_img_scaled is None:
+            print(f"Error: Could not open person photo {person_photo_path}")
+            return None
+        unit_canvas = person_img_scaled.copy()
+    except cv2.error as e:
         print(f"Error: Could not resize person photo {person_photo_path}: {e}")
         return None
+    scaled_person_height = unit_canvas.shape[0]
 
-    # Create the unit canvas, same size as the scaled person photo
-    unit_canvas = person_img_scaled.copy() # Start with the person's photo as the base
+    try:
+        qr_img_resized = _load_resized_qr(qr_code_path, _mtime_ns(qr_code_path), tuple(qr_target_display_size))
+        if qr_img_resized is None:
+            print(f"Error: Could not open QR code {qr_code_path}")
+            return None
+    except cv2.error as e:
+        print(f"Error: Could not resize QR code {qr_code_path}: {e}")
+        return None
 
     # Calculate QR code position on this unit_canvas
     # Horizontally center the QR code
@@ -86,57 +131,141 @@ def create_person_qr_unit(
         qr_pos_y = scaled_person_height - qr_target_display_size[1] # Place it at the bottom edge
     if qr_pos_y < 0 : qr_pos_y = 0 # Ensure it's not above top if photo is tiny
 
-    # Paste QR code onto the unit_canvas (person's scaled photo)
-    unit_canvas.paste(qr_img_resized, (qr_pos_x, qr_pos_y), qr_img_resized if qr_img_resized.mode == 'RGBA' else None)
+    # Composite the QR code onto the unit_canvas (person's scaled photo), clipped to the canvas
+    qr_w = min(qr_target_display_size[0], scaled_person_width - qr_pos_x)
+    qr_h = min(qr_target_display_size[1], scaled_person_height - qr_pos_y)
+    if qr_w <= 0 or qr_h <= 0:
+        return unit_canvas
+    qr_img_resized = qr_img_resized[:qr_h, :qr_w]
+    roi = unit_canvas[qr_pos_y:qr_pos_y + qr_h, qr_pos_x:qr_pos_x + qr_w]
+    if qr_img_resized.ndim == 2: # Grayscale/1-bit QR PNGs are fully opaque
+        roi[:] = qr_img_resized[..., None]
+    elif qr_img_resized.shape[2] == 4:
+        alpha = qr_img_resized[..., 3:4].astype(np.float32) * (1 / 255)
+        roi[:] = (alpha * qr_img_resized[..., :3] + (1 - alpha) * roi).astype(np.uint8)
+    else:
+        roi[:] = qr_img_resized
     
     return unit_canvas
 
-def create_group_scene_image(person_qr_units: List[Image.Image], output_path: str):
+def create_group_scene_image(person_qr_units: Iterable[np.ndarray], output_path: str):
     """
     Arranges multiple 'person_qr_unit' images onto a larger canvas.
+    Units are consumed one at a time, so a generator lets each unit be freed once it is pasted.
     """
-    if not person_qr_units:
-        print("Warning: No person_qr_units provided to create_group_scene_image. Skipping.")
-        return
+    scene_canvas = np.empty((NEW_CANVAS_HEIGHT, NEW_CANVAS_WIDTH, 3), dtype=np.uint8)
+    scene_canvas[:] = CANVAS_BG_COLOR
+
+    # Occupancy grid of placed units, each marked inflated by the minimum spacing so that
+    # queries only test the bare unit footprint. All fitting positions are found at once
+    # from a summed-area table, and one is picked at random.
+    cell = PLACEMENT_GRID_CELL_SIZE
+    grid_h = -(-NEW_CANVAS_HEIGHT // cell)
+    grid_w = -(-NEW_CANVAS_WIDTH // cell)
+    occupied = np.zeros((grid_h, grid_w), dtype=bool)
+    pad = -(-MIN_SPACING_BETWEEN_PERSON_UNITS // cell)
+
+    num_units = 0
+    for unit_img in person_qr_units:
+        num_units += 1
+        unit_h, unit_w = unit_img.shape[:2]
+        unit_cells_h = -(-unit_h // cell)
+        unit_cells_w = -(-unit_w // cell)
+        # Top-left cells that keep the unit inside the canvas (empty if the unit is too large)
+        ys = np.arange((NEW_CANVAS_HEIGHT - unit_h) // cell + 1)
+        xs = np.arange((NEW_CANVAS_WIDTH - unit_w) // cell + 1)
+
+        sat = np.zeros((grid_h + 1, grid_w + 1), dtype=np.int32)
+        sat[1:, 1:] = occupied.cumsum(axis=0).cumsum(axis=1)
+        y0, y1 = ys[:, None], (ys + unit_cells_h)[:, None]
+        x0, x1 = xs[None, :], (xs + unit_cells_w)[None, :]
+        window_sums = sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+        free_positions = np.flatnonzero(window_sums == 0)
+
+        if free_positions.size == 0:
+            print(f"Warning: Could not place a person_qr_unit of size {(unit_w, unit_h)} without overlap.")
+            continue
 
-    scene_canvas = Image.new('RGB', (NEW_CANVAS_WIDTH, NEW_CANVAS_HEIGHT), CANVAS_BG_COLOR)
-    placed_unit_bboxes = []
+        cy, cx = divmod(int(random.choice(free_positions)), len(xs))
+        pos_x, pos_y = cx * cell, cy * cell
+        scene_canvas[pos_y:pos_y + unit_h, pos_x:pos_x + unit_w] = unit_img
+        occupied[max(cy - pad, 0):cy + unit_cells_h + pad, max(cx - pad, 0):cx + unit_cells_w + pad] = True
 
-    for unit_img in person_qr_units:
-        unit_w, unit_h = unit_img.size
-        placed = False
-        for _ in range(MAX_PLACEMENT_ATTEMPTS_PERSON_UNIT):
-            pos_x = random.randint(0, NEW_CANVAS_WIDTH - unit_w)
-            pos_y = random.randint(0, NEW_CANVAS_HEIGHT - unit_h)
-            
-            current_bbox = (pos_x, pos_y, pos_x + unit_w, pos_y + unit_h)
-            overlap = False
-            for placed_bbox in placed_unit_bboxes:
-                # Check for overlap with spacing
-                if not (
-                    current_bbox[2] + MIN_SPACING_BETWEEN_PERSON_UNITS < placed_bbox[0] or
-                    current_bbox[0] - MIN_SPACING_BETWEEN_PERSON_UNITS > placed_bbox[2] or
-                    current_bbox[3] + MIN_SPACING_BETWEEN_PERSON_UNITS < placed_bbox[1] or
-                    current_bbox[1] - MIN_SPACING_BETWEEN_PERSON_UNITS > placed_bbox[3]
-                ):
-                    overlap = True
-                    break
-            
-            if not overlap:
-                scene_canvas.paste(unit_img, (pos_x, pos_y))
-                placed_unit_bboxes.append(current_bbox)
-                placed = True
-                break
-        
-        if not placed:
-            print(f"Warning: Could not place a person_qr_unit of size {unit_img.size} without overlap after attempts.")
+    if not num_units:
+        print("Warning: No person_qr_units provided to create_group_scene_image. Skipping.")
+        return
+    del unit_img # Last unit; the earlier ones were released as the loop rebound the name
 
     try:
-        scene_canvas.save(output_path)
+        # Low zlib level: these scenes are regenerated test inputs, encode speed matters more than size
+        if not cv2.imwrite(output_path, scene_canvas, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+            raise IOError("cv2.imwrite returned False")
         print(f"Successfully created group scene image: {output_path}")
     except Exception as e:
         print(f"Error saving group scene image to {output_path}: {e}")
 
+def _build_scene(i_img: int, seed: int, qr_paths: List[str], photo_paths: List[str], out_dir: str):
+    """Builds and saves sample image number i_img+1. Runs in a worker process, so it takes
+    only paths (cheap to pickle) and its own RNG seed, and reopens the files it needs.
+    """
+    random.seed(seed)
+    num_persons_for_this_image = random.randint(MIN_PERSONS_PER_IMAGE, MAX_PERSONS_PER_IMAGE)
+    
+    # Ensure enough unique photos and QRs for THIS image
+    if len(photo_paths) < num_persons_for_this_image or len(qr_paths) < num_persons_for_this_image:
+        print(f"Warning: Not enough unique photos ({len(photo_paths)}) or QR codes ({len(qr_paths)}) to select {num_persons_for_this_image} distinct persons for image {i_img+1}.")
+        num_persons_for_this_image = min(len(photo_paths), len(qr_paths))
+        if num_persons_for_this_image == 0:
+            print(f"Skipping image {i_img+1} as no photos or QR codes are available for pairing.")
+            return
+        print(f"Adjusting to {num_persons_for_this_image} persons for this image.")
+
+    # Select unique photos and QR codes for the current image
+    try:
+        selected_photo_paths = random.sample(photo_paths, num_persons_for_this_image)
+        selected_qr_code_paths = random.sample(qr_paths, num_persons_for_this_image)
+    except ValueError as e:
+        print(f"Error sampling photos/QRs for image {i_img+1} (requested {num_persons_for_this_image}): {e}. Skipping this image.")
+        return
+
+    if not selected_photo_paths or not selected_qr_code_paths:
+        print(f"Skipping image {i_img+1} as no photo or QR code paths could be selected.")
+        return
+        
+    print(f"\nCreating sample image {i_img+1}/{NUM_SAMPLE_IMAGES_TO_CREATE} with {num_persons_for_this_image} persons...")
+
+    actual_qr_ids_in_image = [] # To store the QR IDs actually used in this image
+
+    def person_qr_units() -> Iterator[np.ndarray]:
+        # Built lazily so only the unit being pasted is alive, not the whole image's worth
+        for person_photo_p, qr_code_p in zip(selected_photo_paths, selected_qr_code_paths):
+            qr_id_val = os.path.splitext(os.path.basename(qr_code_p))[0] # Get ID from QR filename
+
+            unit = create_person_qr_unit(
+                person_photo_path=person_photo_p, 
+                qr_code_path=qr_code_p,
+                qr_target_display_size=QR_DISPLAY_SIZE,
+                scale_factor=PERSON_PHOTO_SCALE_TO_QR_WIDTH_FACTOR
+            )
+            if unit is not None:
+                actual_qr_ids_in_image.append(qr_id_val) # Keep track of the QR ID
+                yield unit
+            del unit
+
+    # The output filename should somehow reflect the QR IDs it contains for easier mapping later
+    # For now, just a generic name. This could be improved by storing metadata.
+    # Example: sample_image_1_qrs_id1_id2_id3.png
+    # For simplicity now, let's keep the old naming and rely on detection.
+    output_file_name = f"sample_image_{i_img+1}.png"
+    output_file_path = os.path.join(out_dir, output_file_name)
+    
+    create_group_scene_image(person_qr_units(), output_file_path)
+    # Store a mapping of image filename to the QR IDs it contains
+    # This is crucial for main.py if we want to avoid re-detecting QR from these specific images
+    # For now, main.py will still detect them. This metadata can be an enhancement.
+    # Example: with open(os.path.join(out_dir, f"sample_image_{i_img+1}_metadata.json"), 'w') as mf:
+    #    json.dump({"filename": output_file_name, "qr_ids": actual_qr_ids_in_image}, mf, indent=4)
+
 if __name__ == "__main__":
     print("--- Starting Sample Test Image Generation Process (Person Units) ---")
     app_config = load_config()
@@ -160,7 +289,6 @@ if __name__ == "__main__":
     
     print(f"Found {len(all_qr_code_paths)} QR codes and {len(all_person_photo_paths)} person photos.")
 
-    os.makedirs(sample_images_output_dir, exist_ok=True)
     print(f"Sample images will be saved to: {sample_images_output_dir}")
 
     # Manage unique pairing: Create a list of available (photo_path, qr_path) unique pairs
@@ -184,66 +312,22 @@ if __name__ == "__main__":
     #     unique_pairs_pool.append((all_person_photo_paths[i], all_qr_code_paths[i], qr_id))
 
 
-    for i_img in range(NUM_SAMPLE_IMAGES_TO_CREATE):
-        num_persons_for_this_image = random.randint(MIN_PERSONS_PER_IMAGE, MAX_PERSONS_PER_IMAGE)
-        
-        # Ensure enough unique photos and QRs for THIS image
-        if len(all_person_photo_paths) < num_persons_for_this_image or len(all_qr_code_paths) < num_persons_for_this_image:
-            print(f"Warning: Not enough unique photos ({len(all_person_photo_paths)}) or QR codes ({len(all_qr_code_paths)}) to select {num_persons_for_this_image} distinct persons for image {i_img+1}.")
-            num_persons_for_this_image = min(len(all_person_photo_paths), len(all_qr_code_paths))
-            if num_persons_for_this_image == 0:
-                print(f"Skipping image {i_img+1} as no photos or QR codes are available for pairing.")
-                continue
-            print(f"Adjusting to {num_persons_for_this_image} persons for this image.")
-
-        # Select unique photos and QR codes for the current image
-        try:
-            selected_photo_paths = random.sample(all_person_photo_paths, num_persons_for_this_image)
-            selected_qr_code_paths = random.sample(all_qr_code_paths, num_persons_for_this_image)
-        except ValueError as e:
-            print(f"Error sampling photos/QRs for image {i_img+1} (requested {num_persons_for_this_image}): {e}. Skipping this image.")
-            continue
-
-        if not selected_photo_paths or not selected_qr_code_paths:
-            print(f"Skipping image {i_img+1} as no photo or QR code paths could be selected.")
-            continue
-            
-        current_person_qr_units = []
-        print(f"\nCreating sample image {i_img+1}/{NUM_SAMPLE_IMAGES_TO_CREATE} with {num_persons_for_this_image} persons...")
-
-        actual_qr_ids_in_image = [] # To store the QR IDs actually used in this image
-        for idx in range(num_persons_for_this_image):
-            person_photo_p = selected_photo_paths[idx]
-            qr_code_p = selected_qr_code_paths[idx]
-            qr_id_val = os.path.splitext(os.path.basename(qr_code_p))[0] # Get ID from QR filename
-            
-            unit = create_person_qr_unit(
-                person_photo_path=person_photo_p, 
-                qr_code_path=qr_code_p,
-                qr_target_display_size=QR_DISPLAY_SIZE,
-                scale_factor=PERSON_PHOTO_SCALE_TO_QR_WIDTH_FACTOR
-            )
-            if unit:
-                current_person_qr_units.append(unit)
-                actual_qr_ids_in_image.append(qr_id_val) # Keep track of the QR ID
-        
-        if not current_person_qr_units:
-            print(f"Could not create any person-QR units for image {i_img+1}. Skipping.")
-            continue
-
-        # The output filename should somehow reflect the QR IDs it contains for easier mapping later
-        # For now, just a generic name. This could be improved by storing metadata.
-        # Example: sample_image_1_qrs_id1_id2_id3.png
-        # For simplicity now, let's keep the old naming and rely on detection.
-        output_file_name = f"sample_image_{i_img+1}.png"
-        output_file_path = os.path.join(sample_images_output_dir, output_file_name)
-        
-        create_group_scene_image(current_person_qr_units, output_file_path)
-        # Store a mapping of image filename to the QR IDs it contains
-        # This is crucial for main.py if we want to avoid re-detecting QR from these specific images
-        # For now, main.py will still detect them. This metadata can be an enhancement.
-        # Example: with open(os.path.join(sample_images_output_dir, f"sample_image_{i_img+1}_metadata.json"), 'w') as mf:
-        #    json.dump({"filename": output_file_name, "qr_ids": actual_qr_ids_in_image}, mf, indent=4)
-
+    # Each scene is independent; build them in parallel worker processes.
+    # Seeds are drawn here so runs stay reproducible under random.seed() in the parent.
+    seeds = [random.randrange(2**32) for _ in range(NUM_SAMPLE_IMAGES_TO_CREATE)]
+    num_workers = min(NUM_SAMPLE_IMAGES_TO_CREATE, os.cpu_count() or 1)
+    # One contiguous run of scenes per worker: the decoded-asset caches are per process,
+    # so a worker only gets cache hits across the scenes it builds itself
+    scenes_per_worker = -(-NUM_SAMPLE_IMAGES_TO_CREATE // num_workers)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        list(executor.map(
+            _build_scene,
+            range(NUM_SAMPLE_IMAGES_TO_CREATE),
+            seeds,
+            repeat(all_qr_code_paths),
+            repeat(all_person_photo_paths),
+            repeat(sample_images_output_dir),
+            chunksize=scenes_per_worker
+        ))
 
     print("\n--- Sample Test Image Generation Process Finished ---") 
\ No newline at end of file
@@ -1,52 +1,132 @@
-from typing import List, Dict, Tuple
+from typing import Dict, List, Tuple, Union
+import logging
+import mmap
 import cv2
-from pyzbar.pyzbar import decode
+import numpy as np
+from pyzbar.pyzbar import decode, ZBarSymbol
 
-def detect_qr_codes(image_path: str) -> List[Dict[str, any]]:
+log = logging.getLogger(__name__)
+
+# Pure-CPU pipeline: skip OpenCV's one-time OpenCL device probe
+cv2.ocl.setUseOpenCL(False)
+
+# Images larger than this (longest side, px) get their adaptive-threshold retry at an integer downscale
+DETECTION_MAX_DIM = 1024
+
+def _read_gray(image_path: str) -> np.ndarray:
+    """Decodes an image file as grayscale from a read-only memory map of it (no read() copy)."""
+    with open(image_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped: # Raises ValueError if empty
+            encoded = np.frombuffer(mapped, dtype=np.uint8)
+            gray_img = cv2.imdecode(encoded, cv2.IMREAD_GRAYSCALE)
+            del encoded # Release the buffer export so the map can close
+    return gray_img
+
+def _decode_qr(gray_img: np.ndarray) -> List[Tuple[bytes, Tuple[int, int, int, int]]]:
+    """Returns (data, (left, top, width, height)) for each QR code in a grayscale image."""
+    return [(obj.data, obj.rect) for obj in decode(gray_img, symbols=[ZBarSymbol.QRCODE])]
+
+# Per-process scratch buffers reused across a batch instead of allocating a frame per image
+_scratch_buffers: Dict[str, np.ndarray] = {}
+
+def _scratch(name: str, height: int, width: int) -> np.ndarray:
+    """Contiguous (height, width) uint8 array backed by a buffer that only grows.
+    Valid until the next call with the same name (not thread-safe).
+    """
+    buf = _scratch_buffers.get(name)
+    if buf is None or buf.size < height * width:
+        buf = _scratch_buffers[name] = np.empty(height * width, dtype=np.uint8)
+    return buf[:height * width].reshape(height, width)
+
+def _to_gray(img: np.ndarray) -> np.ndarray:
+    """Single-channel view of an already-decoded image, converting only when it has color.
+    Converted images live in a scratch buffer, so use the result before the next call.
+    """
+    if img.ndim == 2:
+        return img # Already grayscale, nothing to do
+    if img.shape[2] == 1:
+        return img[:, :, 0]
+    dst = _scratch("gray", img.shape[0], img.shape[1])
+    code = cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+    return cv2.cvtColor(img, code, dst=dst)
+
+def _no_detections() -> Tuple[List[str], np.ndarray]:
+    return [], np.empty((0, 4), dtype=np.int32)
+
+def detect_qr_codes(image_path: Union[str, bytes, np.ndarray]) -> Tuple[List[str], np.ndarray]:
     """
     Locate and decode all QR codes in an image.
-    Returns list of {id: str, bbox: (x,y,w,h)}
+    Returns (ids, bboxes): ids[i] is the decoded string of QR i and bboxes[i] its
+    (x,y,w,h) as a row of an int32 array of shape (N, 4),
     using pyzbar on grayscale OpenCV image.
+    image_path may also be the encoded file contents (bytes) if the caller already has them,
+    or an already-decoded image (e.g. read ahead by a prefetch thread); color arrays are
+    converted, grayscale ones are used as-is.
     """
     try:
-        img = cv2.imread(image_path)
-        if img is None:
-            print(f"Error: Image not found or could not be read at {image_path}")
-            return []
+        # Decode straight to grayscale (pyzbar works better with grayscale); no BGR copy or cvtColor pass
+        if isinstance(image_path, str):
+            gray_img = _read_gray(image_path)
+        elif isinstance(image_path, np.ndarray):
+            gray_img = _to_gray(image_path)
+            image_path = "<in-memory image>" # For messages below
+        else:
+            gray_img = cv2.imdecode(np.frombuffer(image_path, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+            image_path = "<in-memory image>" # For messages below
+        if gray_img is None:
+            log.error("Image not found or could not be read at %s", image_path)
+            return _no_detections()
+    except (OSError, ValueError):
+        log.error("Image not found or could not be read at %s", image_path)
+        return _no_detections()
     except Exception as e:
-        print(f"Error reading image at {image_path} with OpenCV: {e}")
-        return []
+        log.error("Error reading image at %s with OpenCV: %s", image_path, e)
+        return _no_detections()
 
-    # Convert to grayscale (pyzbar works better with grayscale)
-    gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-    # Detect QR codes
-    decoded_objects = decode(gray_img)
+    # Detect QR codes only (no 1-D barcode decoders), at full resolution: small codes can vanish
+    # in a downscaled copy. Only if nothing decodes, retry on a locally binarized copy (for
+    # low-contrast/unevenly lit frames); large frames are binarized and scanned at an integer
+    # downscale, which keeps this fallback cheap.
+    decoded_objects = _decode_qr(gray_img)
+    if not decoded_objects:
+        img_h, img_w = gray_img.shape[:2]
+        scale = max(1, max(img_h, img_w) // DETECTION_MAX_DIM)
+        if scale > 1:
+            img_h, img_w = img_h // scale, img_w // scale
+            scan_img = cv2.resize(gray_img, (img_w, img_h), dst=_scratch("small", img_h, img_w), interpolation=cv2.INTER_AREA)
+        else:
+            scan_img = gray_img
+        bin_img = cv2.adaptiveThreshold(scan_img, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 31, 5,
+                                        dst=_scratch("binary", img_h, img_w))
+        decoded_objects = _decode_qr(bin_img)
+        if scale > 1: # Back to full-resolution coordinates
+            decoded_objects = [(data, tuple(v * scale for v in rect)) for data, rect in decoded_objects]
 
-    detections = []
     if not decoded_objects:
-        print(f"No QR codes found in {image_path}")
-        return []
+        log.info("No QR codes found in %s", image_path)
+        return _no_detections()
 
-    for obj in decoded_objects:
-        # The data attribute of the DecodedObject is bytes, so decode to string
+    ids: List[str] = []
+    rects = []
+    # Bound methods hoisted out of the loop; matters for frames with many codes
+    append_id, append_rect, utf8_decode = ids.append, rects.append, bytes.decode
+    debug_enabled = log.isEnabledFor(logging.DEBUG)
+    for data, rect in decoded_objects:
+        # The decoded data is bytes, so decode to string
         try:
-            qr_id = obj.data.decode('utf-8')
+            qr_id = utf8_decode(data, 'utf-8')
         except UnicodeDecodeError:
-            print(f"Could not decode QR data to UTF-8: {obj.data}. Skipping this QR code.")
+            log.warning("Could not decode QR data to UTF-8: %r. Skipping this QR code.", data)
             continue
             
         # Get the bounding box
-        rect = obj.rect
-        bbox: Tuple[int, int, int, int] = (rect.left, rect.top, rect.width, rect.height)
-        
-        detections.append({
-            "id": qr_id,
-            "bbox": bbox
-        })
-        # print(f"Detected QR Code. ID: {qr_id}, BBox: {bbox}") # For debugging
-        
-    return detections
+        append_id(qr_id)
+        append_rect(rect) # (left, top, width, height)
+        if debug_enabled:
+            log.debug("Detected QR Code. ID: %s, BBox: %s", qr_id, rect)
+
+    bboxes = np.fromiter((v for rect in rects for v in rect), dtype=np.int32, count=len(rects) * 4).reshape(-1, 4)
+    return ids, bboxes
 
 if __name__ == '__main__':
     # This is an example of how to use the function.
@@ -81,21 +161,20 @@ if __name__ == '__main__':
             )
             qr.add_data("test_id_123")
             qr.make(fit=True)
-            img_qr = qr.make_image(fill_color="black", back_color="white").convert('RGB')
+            img_qr = qr.make_image(fill_color="black", back_color="white")
             
             # Save it as a PNG that OpenCV can read
-            # Convert PIL image to OpenCV format
-            pil_image = img_qr
-            numpy_image = np.array(pil_image)
-            cv_image = cv2.cvtColor(numpy_image, cv2.COLOR_RGBBGR) # Convert RGB to BGR for OpenCV
+            # Convert PIL image to OpenCV format; a black/white QR needs no color channels,
+            # so grayscale avoids the RGB->BGR swap entirely
+            cv_image = np.array(img_qr.convert('L'))
 
             dummy_image_path = "dummy_test_qr.png" # Save in current dir for simplicity
             cv2.imwrite(dummy_image_path, cv_image)
             print(f"Created dummy QR image: {dummy_image_path}")
             
-            detected = detect_qr_codes(dummy_image_path)
-            if detected:
-                print(f"Successfully detected QR codes in dummy image: {detected}")
+            detected_ids, detected_bboxes = detect_qr_codes(dummy_image_path)
+            if detected_ids:
+                print(f"Successfully detected QR codes in dummy image: {list(zip(detected_ids, detected_bboxes.tolist()))}")
             else:
                 print("Failed to detect QR codes in the dummy image. Check dependencies (pyzbar, opencv). ")
             os.remove(dummy_image_path) # Clean up dummy image
@@ -107,10 +186,10 @@ if __name__ == '__main__':
 
     else:
         # If sample_group.jpg exists
-        detections = detect_qr_codes(sample_image_path)
-        if detections:
-            print(f"Detected {len(detections)} QR codes:")
-            for det in detections:
-                print(f"  ID: {det['id']}, Bounding Box: {det['bbox']}")
+        detected_ids, detected_bboxes = detect_qr_codes(sample_image_path)
+        if detected_ids:
+            print(f"Detected {len(detected_ids)} QR codes:")
+            for qr_id, bbox in zip(detected_ids, detected_bboxes.tolist()):
+                print(f"  ID: {qr_id}, Bounding Box: {tuple(bbox)}")
         else:
             print(f"No QR codes detected in {sample_image_path}.")
@@ -1,112 +1,149 @@
 import os
-import glob # For finding sample images
-from typing import Optional, List # Import Optional and List for Python 3.9 compatibility
-from src.utils import load_config
+# Pure-CPU pipeline: keep OpenCV from loading/probing an OpenCL runtime (must be set before cv2 is imported)
+os.environ.setdefault("OPENCV_OPENCL_RUNTIME", "disabled")
+import logging
+import multiprocessing
+import queue
+import threading
+import cv2
+import numpy as np
+from typing import Optional, List, Dict, Tuple # Import Optional and List for Python 3.9 compatibility
+from src.utils import load_config, Config, DEFAULT_CONFIG
 from src.detect_qr import detect_qr_codes
-from src.score_relevance import load_profiles as load_profiles_for_scoring, rank_profiles # get_user_embedding removed
+from src.score_relevance import load_profiles as load_profiles_for_scoring, build_score_index, rank_profiles_indexed, ScoreIndex # get_user_embedding removed
 from src.annotate_image import annotate_image
 
-# Load configuration
-config = load_config()
+log = logging.getLogger(__name__)
 
-PROFILES_JSON_PATH = config.get("PROFILES_JSON_PATH") # Should be data/profile_relevance.json
-# QR_CODES_DIR = config.get("QR_CODES_DIR") # Not directly used by main processing pipeline anymore
-CONFIG_INPUT_IMAGE_PATH = config.get("INPUT_IMAGE_PATH") # Path from config
-SAMPLE_IMAGES_DIR = config.get("SAMPLE_IMAGES_DIR") # assets/sample_test_images/
-OUTPUT_IMAGE_DIR = config.get("OUTPUT_IMAGE_DIR") # Updated from OUTPUT_IMAGE_PATH
-TOP_K_RESULTS = config.get("TOP_K_RESULTS", 3)
-# USER_BIO_FOR_MAIN = config.get("USER_BIO") # User bio for main is no longer needed for scoring
-# NUM_PROFILES_TO_GENERATE = config.get("NUM_PROFILES_TO_GENERATE", 20) # Not for main.py anymore
+# Settings, from the defaults until _apply_config() installs the loaded config.json.
+# config.json is not read at import time: load_config() logs (legacy/unknown keys), and
+# logging is only configured once __main__ runs.
+PROFILES_JSON_PATH = DEFAULT_CONFIG.PROFILES_JSON_PATH # Should be data/profile_relevance.json
+# QR_CODES_DIR = config.QR_CODES_DIR # Not directly used by main processing pipeline anymore
+CONFIG_INPUT_IMAGE_PATH = DEFAULT_CONFIG.INPUT_IMAGE_PATH # Path from config
+SAMPLE_IMAGES_DIR = DEFAULT_CONFIG.SAMPLE_IMAGES_DIR # assets/sample_test_images/
+OUTPUT_IMAGE_DIR = DEFAULT_CONFIG.OUTPUT_IMAGE_DIR # Updated from OUTPUT_IMAGE_PATH
+TOP_K_RESULTS = DEFAULT_CONFIG.TOP_K_RESULTS
+# USER_BIO_FOR_MAIN = config.USER_BIO # User bio for main is no longer needed for scoring
+# NUM_PROFILES_TO_GENERATE = config.NUM_PROFILES_TO_GENERATE # Not for main.py anymore
 
-def check_required_data_exists():
-    """Checks if essential data files and directories exist, guides user if not."""
+def _apply_config(config: Config):
+    """Installs the loaded configuration as this module's settings."""
+    global PROFILES_JSON_PATH, CONFIG_INPUT_IMAGE_PATH, SAMPLE_IMAGES_DIR, OUTPUT_IMAGE_DIR, TOP_K_RESULTS
+    PROFILES_JSON_PATH = config.PROFILES_JSON_PATH
+    CONFIG_INPUT_IMAGE_PATH = config.INPUT_IMAGE_PATH
+    SAMPLE_IMAGES_DIR = config.SAMPLE_IMAGES_DIR
+    OUTPUT_IMAGE_DIR = config.OUTPUT_IMAGE_DIR
+    TOP_K_RESULTS = config.TOP_K_RESULTS
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+def list_image_files(directory: str) -> List[str]:
+    """Sorted paths of the images (.png, .jpg, .jpeg) in a directory, from a single os.scandir pass."""
+    with os.scandir(directory) as entries:
+        return sorted(
+            entry.path for entry in entries
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS) and not entry.name.startswith(".") and entry.is_file()
+        )
+
+def check_required_data_exists() -> Tuple[bool, List[str]]:
+    """Checks if essential data files and directories exist, guides user if not.
+    Also returns the images found in SAMPLE_IMAGES_DIR, so get_input_image_paths can reuse the listing.
+    """
     data_ok = True
-    if not PROFILES_JSON_PATH or not os.path.exists(PROFILES_JSON_PATH) or os.path.getsize(PROFILES_JSON_PATH) == 0:
+    try:
+        profiles_size = os.stat(PROFILES_JSON_PATH).st_size if PROFILES_JSON_PATH else 0 # One stat for exists + size
+    except OSError:
+        profiles_size = 0
+    if profiles_size == 0:
         print(f"Error: Profiles data file ('{PROFILES_JSON_PATH}') not found or is empty.")
         print(f"Please run: python src/prepare_data.py")
         data_ok = False
     
-    if not SAMPLE_IMAGES_DIR or not os.path.exists(SAMPLE_IMAGES_DIR) or not os.listdir(SAMPLE_IMAGES_DIR):
+    try:
+        # Check if there are actual image files; the listing doubles as the existence check
+        sample_image_paths = list_image_files(SAMPLE_IMAGES_DIR) if SAMPLE_IMAGES_DIR else None
+    except OSError:
+        sample_image_paths = None
+    if sample_image_paths is None:
+        sample_image_paths = []
         print(f"Error: Sample images directory ('{SAMPLE_IMAGES_DIR}') not found or is empty.")
         print(f"Please run: python src/create_sample_images.py")
         data_ok = False
-    else:
-        # Check if there are actual image files
-        image_files = glob.glob(os.path.join(SAMPLE_IMAGES_DIR, "*.png")) + \
-                      glob.glob(os.path.join(SAMPLE_IMAGES_DIR, "*.jpg")) + \
-                      glob.glob(os.path.join(SAMPLE_IMAGES_DIR, "*.jpeg"))
-        if not image_files:
-            print(f"Error: No images (.png, .jpg, .jpeg) found in sample images directory ('{SAMPLE_IMAGES_DIR}').")
-            print(f"Please run: python src/create_sample_images.py")
-            data_ok = False
+    elif not sample_image_paths:
+        print(f"Error: No images (.png, .jpg, .jpeg) found in sample images directory ('{SAMPLE_IMAGES_DIR}').")
+        print(f"Please run: python src/create_sample_images.py")
+        data_ok = False
             
-    return data_ok
+    return data_ok, sample_image_paths
 
-def get_input_image_paths() -> List[str]: # Renamed and changed return type
+def get_input_image_paths(sample_image_paths: Optional[List[str]] = None) -> List[str]: # Renamed and changed return type
     """Determines the input image paths to use. 
     Returns a list of image paths.
     Priority:
     1. Configured INPUT_IMAGE_PATH (if it's a file).
     2. All images in INPUT_IMAGE_PATH (if it's a directory).
     3. All images in SAMPLE_IMAGES_DIR (if INPUT_IMAGE_PATH is not set/valid).
+    sample_image_paths is the SAMPLE_IMAGES_DIR listing from check_required_data_exists, if available.
     """
     image_paths: List[str] = []
-    image_extensions = ("*.png", "*.jpg", "*.jpeg")
 
     # 1. Try the path from config.json
     if CONFIG_INPUT_IMAGE_PATH:
         if os.path.isfile(CONFIG_INPUT_IMAGE_PATH):
-            print(f"Using specific input image from config: {CONFIG_INPUT_IMAGE_PATH}")
+            log.info("Using specific input image from config: %s", CONFIG_INPUT_IMAGE_PATH)
             image_paths.append(CONFIG_INPUT_IMAGE_PATH)
             return image_paths
         elif os.path.isdir(CONFIG_INPUT_IMAGE_PATH):
-            print(f"Using input directory from config: {CONFIG_INPUT_IMAGE_PATH}")
-            for ext in image_extensions:
-                image_paths.extend(glob.glob(os.path.join(CONFIG_INPUT_IMAGE_PATH, ext)))
+            log.info("Using input directory from config: %s", CONFIG_INPUT_IMAGE_PATH)
+            image_paths = list_image_files(CONFIG_INPUT_IMAGE_PATH)
             if image_paths:
-                print(f"Found {len(image_paths)} images in {CONFIG_INPUT_IMAGE_PATH}.")
-                return sorted(image_paths)
+                log.info("Found %d images in %s.", len(image_paths), CONFIG_INPUT_IMAGE_PATH)
+                return image_paths
             else:
-                print(f"Warning: No images found in configured directory: {CONFIG_INPUT_IMAGE_PATH}")
+                log.warning("No images found in configured directory: %s", CONFIG_INPUT_IMAGE_PATH)
         else:
-            print(f"Warning: Input path '{CONFIG_INPUT_IMAGE_PATH}' from config is not a valid file or directory.")
+            log.warning("Input path '%s' from config is not a valid file or directory.", CONFIG_INPUT_IMAGE_PATH)
 
     # 2. If not found or not specified as a valid file/directory, try SAMPLE_IMAGES_DIR
-    if not image_paths and SAMPLE_IMAGES_DIR and os.path.exists(SAMPLE_IMAGES_DIR):
-        print(f"Searching for images in default sample directory: {SAMPLE_IMAGES_DIR}")
-        for ext in image_extensions:
-            image_paths.extend(glob.glob(os.path.join(SAMPLE_IMAGES_DIR, ext)))
+    if not image_paths and SAMPLE_IMAGES_DIR and os.path.isdir(SAMPLE_IMAGES_DIR):
+        log.info("Searching for images in default sample directory: %s", SAMPLE_IMAGES_DIR)
+        image_paths = sample_image_paths if sample_image_paths is not None else list_image_files(SAMPLE_IMAGES_DIR)
         
         if image_paths:
-            print(f"Found {len(image_paths)} images in {SAMPLE_IMAGES_DIR}.")
-            return sorted(image_paths)
+            log.info("Found %d images in %s.", len(image_paths), SAMPLE_IMAGES_DIR)
+            return image_paths
     
     if not image_paths:
-        print(f"Error: No valid input images found.")
-        print(f"Checked config path: '{CONFIG_INPUT_IMAGE_PATH}'")
-        print(f"Checked sample directory: '{SAMPLE_IMAGES_DIR}'")
+        log.error("No valid input images found. Checked config path: '%s'. Checked sample directory: '%s'",
+                  CONFIG_INPUT_IMAGE_PATH, SAMPLE_IMAGES_DIR)
     return []
 
-def run_image_processing_pipeline(input_image: str, output_image: str):
-    """Runs the main image processing pipeline: detect, score, annotate."""
-    print(f"--- Running Image Processing Pipeline for {input_image} ---")
+def run_image_processing_pipeline(
+    input_image: str,
+    output_image: str,
+    all_profiles_data: Dict[str, Dict],
+    gray_image: Optional[np.ndarray] = None,
+    score_index: Optional[ScoreIndex] = None
+):
+    """Runs the main image processing pipeline: detect, score, annotate.
+    all_profiles_data is loaded once by the caller and shared across images, as can be its
+    build_score_index (score_index); otherwise the index is built here.
+    gray_image is input_image already read as grayscale, if the caller prefetched it.
+    """
+    log.info("--- Running Image Processing Pipeline for %s ---", input_image)
 
     # 1. Detect QR Codes
-    print("Step 1: Detecting QR codes...")
-    detections = detect_qr_codes(input_image)
-    if not detections:
+    log.debug("Step 1: Detecting QR codes...")
+    detected_ids, detected_bboxes = detect_qr_codes(gray_image if gray_image is not None else input_image)
+    if not detected_ids:
         print(f"No QR codes detected in {input_image}. Exiting pipeline.")
         return
-    print(f"Detected {len(detections)} QR codes.")
-    detected_ids = [det["id"] for det in detections]
+    log.info("Detected %d QR codes.", len(detected_ids))
+    # The same code can be decoded more than once; rank (and so annotate) each profile once, in detection order
+    unique_ids = list(dict.fromkeys(detected_ids))
 
-    # 2. Load Profiles Data (with pre-calculated relevance)
-    print("\nStep 2: Loading profiles data...")
-    all_profiles_data = load_profiles_for_scoring(PROFILES_JSON_PATH)
-    if not all_profiles_data:
-        print(f"No profiles data loaded from {PROFILES_JSON_PATH}. Ensure profiles exist. Exiting pipeline.")
-        return
-    print(f"Loaded {len(all_profiles_data)} profiles from store.")
+    # 2. Profiles Data (with pre-calculated relevance) is loaded once in __main__
 
     # 3. Get User Embedding - REMOVED (relevance is pre-calculated)
     # print("\nStep 3: Getting user embedding...")
@@ -115,51 +152,109 @@ def run_image_processing_pipeline(input_image: str, output_image: str):
     #     print("Warning: Could not get user embedding. Ranking might not be effective.")
 
     # 4. Rank Profiles (using pre-calculated relevance)
-    print("\nStep 3: Ranking detected profiles...") # Step number adjusted
-    ranked_results = rank_profiles(detected_ids, all_profiles_data, TOP_K_RESULTS)
+    log.debug("Step 2: Ranking detected profiles...") # Step number adjusted
+    if score_index is None:
+        score_index = build_score_index(all_profiles_data)
+    ranked_results = rank_profiles_indexed(unique_ids, score_index, TOP_K_RESULTS)
     if not ranked_results:
-        print("No profiles were ranked. This could be due to no matching IDs, missing relevance scores, or other issues.")
+        log.warning("No profiles were ranked for %s. This could be due to no matching IDs, missing relevance scores, or other issues.", input_image)
     else:
-        print(f"Top {len(ranked_results)} ranked profiles:")
+        # The per-image result is the app's output, so it is printed at any log level, as a single
+        # write so that lines from parallel workers do not interleave
+        lines = [f"Top {len(ranked_results)} ranked profiles for {input_image}:"]
         for r_id, r_score in ranked_results:
             profile_details = all_profiles_data.get(r_id, {})
             profile_name = profile_details.get("name", "Unknown")
             explanation = profile_details.get("relevance_explanation", "N/A")
-            print(f"  ID: {r_id}, Name: {profile_name}, Score: {r_score:.2f}")
-            print(f"    Explanation: {explanation}")
+            lines.append(f"  ID: {r_id}, Name: {profile_name}, Score: {r_score:.2f}")
+            lines.append(f"    Explanation: {explanation}")
+        print("\n".join(lines))
 
     # 5. Annotate Image
     if ranked_results:
-        print("\nStep 4: Annotating image with ranked profiles...") # Step number adjusted
+        log.debug("Step 3: Annotating image with ranked profiles...") # Step number adjusted
         annotate_image(
             input_image_path=input_image,
             output_image_path=output_image,
             ranked_profiles=ranked_results, 
-            all_detections=detections,    
+            all_detections=(detected_ids, detected_bboxes),
             profiles_data=all_profiles_data
         )
     else:
-        print("\nSkipping image annotation as no profiles were ranked.")
+        log.info("Skipping image annotation as no profiles were ranked.")
+
+    log.info("--- Image Processing Pipeline Completed. Check %s if annotations were made ---", output_image)
+
+_worker_profiles_data: Dict[str, Dict] = {} # Set in each pool worker by _preload
+_worker_score_index: Optional[ScoreIndex] = None # Relevance scores as an array, built once in the parent
 
-    print(f"--- Image Processing Pipeline Completed. Check {output_image} if annotations were made ---")
+def _configure_logging():
+    """Per-image step progress is logged at INFO/DEBUG and skipped (unformatted) at the default
+    WARNING level; the per-image results are printed regardless."""
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s") # No-op if already configured
+
+def _preload(all_profiles_data: Dict[str, Dict], score_index: ScoreIndex, top_k: int, single_threaded_cv: bool = False):
+    """Pool initializer. Workers live for the whole batch, so module imports (cv2, pyzbar,
+    pulled in with this module) and the profiles are paid for once per worker, not per image.
+    With one worker per core, OpenCV's own thread pool would oversubscribe the CPUs, so
+    pool workers pass single_threaded_cv; a single-process run keeps OpenCV's threads.
+    Only infallible setup belongs here: multiprocessing.Pool respawns a worker whose
+    initializer raises, forever, so anything that can fail on user data is done in the parent.
+    """
+    global _worker_profiles_data, _worker_score_index, TOP_K_RESULTS
+    _configure_logging() # Spawned workers do not inherit the parent's logging setup
+    if single_threaded_cv:
+        cv2.setNumThreads(1)
+    cv2.ocl.setUseOpenCL(False)
+    _worker_profiles_data = all_profiles_data
+    _worker_score_index = score_index
+    TOP_K_RESULTS = top_k # Passed in: a spawned worker re-imports this module with the defaults
+
+def _process_image(paths: Tuple[str, str], gray_image: Optional[np.ndarray] = None):
+    """Runs the pipeline for one (input, output) path pair (in a pool worker, or in-process when sequential)."""
+    input_image_path, final_output_image_path = paths
+    log.info("Starting image processing for: %s", input_image_path)
+
+    run_image_processing_pipeline(
+        input_image=input_image_path, 
+        output_image=final_output_image_path,
+        all_profiles_data=_worker_profiles_data,
+        score_index=_worker_score_index,
+        gray_image=gray_image
+    )
+
+def _prefetch_gray_images(image_paths: List[str], out_queue: queue.Queue):
+    """Producer thread: reads upcoming images as grayscale while the current one is processed."""
+    for path in image_paths:
+        out_queue.put((path, cv2.imread(path, cv2.IMREAD_GRAYSCALE))) # None on failure; detection re-reads and reports
 
 if __name__ == "__main__":
+    _configure_logging()
     print("--- Networking Glasses MVP Application ---")
+    _apply_config(load_config()) # After logging is set up, so config warnings use its format
     # Check if necessary data files exist before proceeding
-    if not check_required_data_exists():
+    data_ok, sample_image_paths = check_required_data_exists()
+    if not data_ok:
         print("\nEssential data missing. Please run the data preparation scripts as instructed above.")
         print("Exiting application.")
         exit()
     
-    input_images_to_process = get_input_image_paths()
+    # Load Profiles Data (with pre-calculated relevance) once for all images
+    print("\nLoading profiles data...")
+    all_profiles_data = load_profiles_for_scoring(PROFILES_JSON_PATH)
+    if not all_profiles_data:
+        print(f"No profiles data loaded from {PROFILES_JSON_PATH}. Ensure profiles exist. Exiting application.")
+        exit()
+    print(f"Loaded {len(all_profiles_data)} profiles from store.")
+
+    input_images_to_process = get_input_image_paths(sample_image_paths)
     
     if not input_images_to_process:
         print("\nCould not determine any input images to process. Exiting application.")
         exit()
 
-    # Ensure output directory exists
+    # The output directory itself is created by load_config()
     if OUTPUT_IMAGE_DIR:
-        os.makedirs(OUTPUT_IMAGE_DIR, exist_ok=True)
         print(f"Annotated images will be saved to: {OUTPUT_IMAGE_DIR}")
     else:
         print("Error: OUTPUT_IMAGE_DIR is not defined in config. Cannot save annotated images.")
@@ -167,16 +262,29 @@ if __name__ == "__main__":
 
     print(f"\nFound {len(input_images_to_process)} image(s) to process.")
 
-    for input_image_path in input_images_to_process:
-        print(f"\nStarting image processing for: {input_image_path}")
-        
-        img_name, img_ext = os.path.splitext(os.path.basename(input_image_path))
-        # Ensure OUTPUT_IMAGE_DIR is used for the output path construction
-        final_output_image_path = os.path.join(OUTPUT_IMAGE_DIR, f"annotated_{img_name}{img_ext}")
-        
-        run_image_processing_pipeline(
-            input_image=input_image_path, 
-            output_image=final_output_image_path
-        )
+    # Ensure OUTPUT_IMAGE_DIR is used for the output path construction; all paths computed up front
+    output_image_paths = [
+        os.path.join(OUTPUT_IMAGE_DIR, f"annotated_{img_name}{img_ext}")
+        for img_name, img_ext in (os.path.splitext(os.path.basename(p)) for p in input_images_to_process)
+    ]
+    jobs = list(zip(input_images_to_process, output_image_paths))
+
+    # Built (and validated) once here rather than in each worker's initializer
+    score_index = build_score_index(all_profiles_data)
+
+    # Images are independent, so run detect -> rank -> annotate for several at once
+    num_workers = min(len(input_images_to_process), os.cpu_count() or 1)
+    if num_workers > 1:
+        with multiprocessing.Pool(processes=num_workers, initializer=_preload, initargs=(all_profiles_data, score_index, TOP_K_RESULTS, True)) as pool:
+            for _ in pool.imap_unordered(_process_image, jobs):
+                pass
+    else:
+        # Sequential: overlap reading image i+1 with processing image i
+        _preload(all_profiles_data, score_index, TOP_K_RESULTS)
+        prefetched: queue.Queue = queue.Queue(maxsize=2)
+        threading.Thread(target=_prefetch_gray_images, args=(input_images_to_process, prefetched), daemon=True).start()
+        for job in jobs:
+            _, gray_image = prefetched.get() # Same order as jobs
+            _process_image(job, gray_image)
 
     print(f"\nApplication finished. Processed {len(input_images_to_process)} image(s).") 
\ No newline at end of file
@@ -1,13 +1,31 @@
 import os
 import json
-from typing import List, Dict
+import asyncio
+import time
+import random
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
 import httpx # Keep for OpenAI client
-from openai import OpenAI # Keep for OpenAI client
-from faker import Faker # Ensure Faker is imported for fallback
+import openai
+from openai import AsyncOpenAI # Keep for OpenAI client
 import qrcode
+import qrcode.exceptions
 import uuid
-from src.utils import load_config
+from src.utils import load_config, DEFAULT_CONFIG
+from src.score_relevance import load_profiles_jsonl
 from tqdm import tqdm # Import tqdm
+try:
+    import orjson # Faster JSON encode/decode; stdlib json is the fallback
+except ImportError:
+    orjson = None
+try:
+    import tiktoken # Optional: exact prompt token counts for the rate limiter
+except ImportError:
+    tiktoken = None
 
 # Initialize Faker - only for fallback if AI completely fails for names, or not at all
 # fake = Faker() 
@@ -18,30 +36,175 @@ DARTMOUTH_CHAT_API_KEY = os.getenv("DARTMOUTH_CHAT_API_KEY")
 if not DARTMOUTH_CHAT_API_KEY:
     print("Warning: DARTMOUTH_CHAT_API_KEY environment variable not set. AI profile generation and relevance scoring will fail or use placeholders.")
 
-# API client for potential chat completion
 # This setup is for a standard OpenAI-compatible API.
 # You MAY need to adjust base_url or other parameters for Dartmouth's specific Chat API.
-http_client_chat = httpx.Client()
-chat_api = OpenAI(
-    base_url="https://chat.dartmouth.edu/api", # Assuming chat completions are at the same base
-    api_key=DARTMOUTH_CHAT_API_KEY,
-    http_client=http_client_chat
-)
+CHAT_API_BASE_URL = "https://chat.dartmouth.edu/api" # Assuming chat completions are at the same base
 
-# --- Phase 1A: Generate Base Profile Content using AI ---
-def generate_ai_profile_contents(num_profiles: int, theme: str, model_name: str) -> List[Dict]:
+# Work is split into small batches sent concurrently, instead of one long request for everything
+# (which is slow and risks truncating the reply at the model's output limit)
+PROFILES_PER_GENERATION_REQUEST = 5
+PROFILES_PER_RELEVANCE_REQUEST = 10
+MAX_CONCURRENT_CHAT_REQUESTS = 4
+
+try:
+    import h2 # noqa: F401 -- httpx needs it for HTTP/2 (pip install httpx[http2])
+    CHAT_HTTP2 = True
+except ImportError:
+    CHAT_HTTP2 = False
+
+def create_chat_client() -> AsyncOpenAI:
+    """Async API client for chat completion. Create one per asyncio.run(): the pooled
+    httpx connections belong to the event loop that opened them.
+    The pool is sized to the concurrency cap and kept alive between batches; with HTTP/2
+    all in-flight requests share one TCP+TLS connection.
     """
-    Generates core content (name, title, bio) for fake profiles using the Chat API.
-    Theme describes the type of profiles to generate (e.g., 'students at a tech and finance career fair').
-    Returns a list of dicts, each with {"name", "title", "bio"}.
+    http_client = httpx.AsyncClient(
+        http2=CHAT_HTTP2,
+        limits=httpx.Limits(max_connections=MAX_CONCURRENT_CHAT_REQUESTS,
+                            max_keepalive_connections=MAX_CONCURRENT_CHAT_REQUESTS,
+                            keepalive_expiry=60.0),
+        timeout=httpx.Timeout(120.0, connect=10.0) # Long replies for big batches; fail fast on connect
+    )
+    return AsyncOpenAI(
+        base_url=CHAT_API_BASE_URL,
+        api_key=DARTMOUTH_CHAT_API_KEY,
+        http_client=http_client,
+        max_retries=0 # Retries are handled by _call_chat
+    )
+
+def json_loads(data):
+    """Parses JSON from str or bytes (orjson if installed). Errors are json.JSONDecodeError either way."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def json_dumps(obj, indent: bool = False) -> bytes:
+    """Serializes obj to UTF-8 JSON bytes (orjson if installed), 2-space indented if requested."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode('utf-8')
+
+# Rough reply size used when reserving tokens before a call; corrected from response.usage afterwards
+ESTIMATED_COMPLETION_TOKENS_PER_PROFILE = 100
+
+@lru_cache(maxsize=8)
+def _token_encoding(model_name: str):
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError: # Non-OpenAI model names; close enough for budgeting
+        return tiktoken.get_encoding("cl100k_base")
+
+def estimate_tokens(text: str, model_name: str) -> int:
+    """Token count of text for model_name; ~4 characters per token if tiktoken is not installed."""
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    return len(_token_encoding(model_name).encode(text))
+
+class RateLimiter:
     """
-    if not DARTMOUTH_CHAT_API_KEY:
-        print("Error: DARTMOUTH_CHAT_API_KEY not set. Cannot perform AI profile generation.")
-        return [] 
+    Client-side token bucket for the Chat API: one bucket for requests and one for tokens,
+    both refilled continuously up to their per-minute limit. acquire() waits until both
+    have capacity, so concurrent calls stay under the limits instead of collecting 429s.
+    Uses no event-loop-bound primitives, so one instance can serve several asyncio.run() calls.
+    """
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_tokens = float(requests_per_minute)
+        self.prompt_tokens = float(tokens_per_minute)
+        self._last_refill = time.monotonic()
 
-    print(f"\nAttempting to generate {num_profiles} profile contents using AI (model: {model_name}). Theme: {theme}...")
-    
-    system_prompt = f"""
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self.request_tokens = min(self.requests_per_minute, self.request_tokens + elapsed * self.requests_per_minute / 60.0)
+        self.prompt_tokens = min(self.tokens_per_minute, self.prompt_tokens + elapsed * self.tokens_per_minute / 60.0)
+
+    async def acquire(self, est_tokens: int) -> int:
+        """Waits for one request and est_tokens tokens; returns the number of tokens reserved."""
+        est_tokens = min(est_tokens, self.tokens_per_minute) # A request larger than the bucket would wait forever
+        while True:
+            self._refill()
+            # No await between the check and the decrement, so this is atomic within the event loop
+            if self.request_tokens >= 1 and self.prompt_tokens >= est_tokens:
+                self.request_tokens -= 1
+                self.prompt_tokens -= est_tokens
+                return est_tokens
+            wait_s = max((1 - self.request_tokens) * 60.0 / self.requests_per_minute,
+                         (est_tokens - self.prompt_tokens) * 60.0 / self.tokens_per_minute)
+            await asyncio.sleep(max(wait_s, 0.01))
+
+    def reconcile(self, reserved_tokens: int, response):
+        """Corrects the token bucket with the usage the API actually reported for a call."""
+        usage = getattr(response, "usage", None)
+        if usage is not None and usage.total_tokens is not None:
+            self.prompt_tokens -= usage.total_tokens - reserved_tokens # May go negative: later calls wait it off
+
+def create_rate_limiter(requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None) -> RateLimiter:
+    return RateLimiter(requests_per_minute or DEFAULT_CONFIG.CHAT_REQUESTS_PER_MINUTE,
+                       tokens_per_minute or DEFAULT_CONFIG.CHAT_TOKENS_PER_MINUTE)
+
+# Transient failures worth retrying; anything else (e.g. openai.BadRequestError) fails the batch immediately
+RETRYABLE_CHAT_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+CHAT_MAX_ATTEMPTS = 6
+CHAT_RETRY_MIN_WAIT_S = 1.0
+CHAT_RETRY_MAX_WAIT_S = 60.0
+
+async def _call_chat(
+    client: AsyncOpenAI, semaphore: asyncio.Semaphore, rate_limiter: RateLimiter,
+    est_tokens: int, batch_label: str, **create_kwargs
+):
+    """
+    chat.completions.create() under the concurrency cap and rate limiter, retrying transient
+    errors with full-jitter exponential backoff (the semaphore is released while waiting).
+    """
+    for attempt in range(1, CHAT_MAX_ATTEMPTS + 1):
+        try:
+            async with semaphore:
+                reserved_tokens = await rate_limiter.acquire(est_tokens)
+                response = await client.chat.completions.create(**create_kwargs)
+            rate_limiter.reconcile(reserved_tokens, response)
+            return response
+        except RETRYABLE_CHAT_ERRORS as e:
+            if attempt == CHAT_MAX_ATTEMPTS:
+                raise
+            wait_s = max(CHAT_RETRY_MIN_WAIT_S, random.uniform(0, min(CHAT_RETRY_MAX_WAIT_S, 2 ** attempt)))
+            print(f"Warning: Chat API call for {batch_label} failed ({type(e).__name__}), attempt {attempt}/{CHAT_MAX_ATTEMPTS}. Retrying in {wait_s:.1f}s.")
+            await asyncio.sleep(wait_s)
+
+# Relevance replies are cached on disk, keyed by a hash of the whole request (model, prompts, parameters),
+# so reruns with an unchanged USER_BIO, model and profile bios do not call the API again
+CHAT_CACHE_DIR = os.path.join(".cache", "llm")
+
+def _chat_cache_path(create_kwargs: Dict) -> str:
+    key = hashlib.sha256(json_dumps(create_kwargs)).hexdigest()
+    return os.path.join(CHAT_CACHE_DIR, f"{key}.json")
+
+def _read_chat_cache(cache_path: str) -> Optional[str]:
+    """Cached reply content for a request, or None on a miss (or unreadable entry)."""
+    try:
+        with open(cache_path, 'rb') as f:
+            return json_loads(f.read())["content"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _write_chat_cache(cache_path: str, content: str):
+    try:
+        os.makedirs(CHAT_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(json_dumps({"content": content}))
+        os.replace(tmp_path, cache_path) # Readers never see a partial entry
+    except OSError as e:
+        print(f"Warning: Could not write Chat API cache entry {cache_path}: {e}")
+
+def _split_into_batches(items: List, batch_size: int) -> List[List]:
+    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+# --- Phase 1A: Generate Base Profile Content using AI ---
+def _profile_generation_system_prompt(num_profiles: int, theme: str) -> str:
+    return f"""
     You are an AI assistant helping to create realistic fake professional profiles for a simulation.
     The profiles should be diverse and suitable for individuals attending a career fair focused on "{theme}".
     Roles to include: students (clearly specify level: Undergraduate, Master's, PhD, Postdoc), recruiters (from tech companies, finance firms, startups), current employees (e.g., Software Engineer, Data Analyst, Product Manager, Investment Banker - from various seniority levels), university alumni, university professors (relevant fields like CS, Economics, etc.), and event organizers/staff.
@@ -51,107 +214,133 @@ def generate_ai_profile_contents(num_profiles: int, theme: str, model_name: str)
     2. "title": A plausible job title, student description with level, or role (e.g., "Software Engineer at TechGiant", "Master's Student in Computer Science", "Recruiter at FinServe Co.", "Professor of Economics", "Event Coordinator"). Consider the theme and requested roles.
     3. "bio": A short professional biography (2-4 sentences) highlighting skills, experiences, and aspirations relevant to the theme and their role. Make them distinct and compelling.
 
-    You MUST return a single JSON string that is a list of exactly {num_profiles} objects. Each object in the list MUST follow this structure strictly:
+    You MUST return a single JSON object of the form {{ "profiles": [...] }}, where "profiles" is a list of exactly {num_profiles} objects. Each object in the list MUST follow this structure strictly:
     {{ "name": "Full Name", "title": "Professional Title/Role", "bio": "A compelling bio..." }}
 
     Example of a single profile object in your response list (ensure your output matches this structure for all items):
     {{ "name": "Dr. Eleanor Vance", "title": "Professor of Computer Science", "bio": "Researching advancements in AI and machine learning. Authored several papers on distributed systems. Keen to connect with industry professionals and students exploring these fields." }}
     {{ "name": "Michael Lee", "title": "Undergraduate Student in Business Analytics", "bio": "Third-year student passionate about data-driven decision making. Seeking an internship in business intelligence or data analysis for summer 202X. Proficient in SQL and Python." }}
 
-    Ensure your entire output is a valid JSON list of these objects. Do not include any other text, explanations, or markdown formatting before or after the JSON list itself.
+    Ensure your entire output is this JSON object. Do not include any other text, explanations, or markdown formatting before or after it.
     """
-    
-    user_content = f"Please generate {num_profiles} distinct professional profiles based on the theme: '{theme}' and the diverse roles specified. Follow the JSON output format strictly."
-    
-    ai_generated_profile_data = []
 
+def _parse_generated_profiles(ai_response_content: str) -> List[Dict]:
+    """Extracts the valid {"name", "title", "bio"} items from a {"profiles": [...]} generation reply.
+    Raises ValueError (incl. json.JSONDecodeError) or KeyError if the reply does not have that shape.
+    """
+    parsed_profiles = json_loads(ai_response_content)["profiles"]
+    if not isinstance(parsed_profiles, list):
+        raise ValueError("AI response 'profiles' was not a JSON list.")
+
+    valid_profiles = []
+    for item in parsed_profiles:
+        if isinstance(item, dict) and "name" in item and "title" in item and "bio" in item:
+            valid_profiles.append({
+                "name": str(item["name"]),
+                "title": str(item["title"]),
+                "bio": str(item["bio"])
+            })
+        else:
+            print(f"Warning: Skipping malformed profile item from AI response: {item}")
+    return valid_profiles
+
+async def _generate_profile_batch(
+    client: AsyncOpenAI, semaphore: asyncio.Semaphore, rate_limiter: RateLimiter, pbar: tqdm,
+    batch_size: int, batch_label: str, theme: str, model_name: str
+) -> List[Dict]:
+    """Generates one batch of profile contents; a failed batch yields [] without affecting the others."""
+    user_content = (f"Please generate {batch_size} distinct professional profiles based on the theme: '{theme}' and the diverse roles specified. "
+                    f"This is {batch_label} of a larger set generated in parallel, so vary names, roles and backgrounds. "
+                    f"Follow the JSON output format strictly.")
+    system_prompt = _profile_generation_system_prompt(batch_size, theme)
+    est_tokens = estimate_tokens(system_prompt + user_content, model_name) + batch_size * ESTIMATED_COMPLETION_TOKENS_PER_PROFILE
     try:
-        print("Sending request to Chat API for profile generation. This might take some time...")
-        # Wrap single API call with a simple tqdm description if desired, though it's one operation
-        # For true progress, API would need to support streaming or per-profile generation
-        # For now, print statements mark start/end. tqdm can be used on processing results if it's a loop.
-        response = chat_api.chat.completions.create(
+        response = await _call_chat(
+            client, semaphore, rate_limiter, est_tokens, batch_label,
             model=model_name,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_content}
             ],
             temperature=0.8, # Slightly higher temperature for more creative/varied profiles
+            response_format={"type": "json_object"}, # Reply is guaranteed to be a JSON object
             # max_tokens can be important here depending on the number of profiles and bio length
         )
-        
         ai_response_content = response.choices[0].message.content
-        print("Received profile generation response from Chat API.")
         # print("Raw AI Profile Response:\n", ai_response_content) # Uncomment for debugging
-
-        if ai_response_content.startswith("```json"):
-            ai_response_content = ai_response_content[len("```json"):].strip()
-            if ai_response_content.endswith("```"):
-                ai_response_content = ai_response_content[:-len("```")].strip()
-        else: # If not wrapped in markdown, try to find JSON list directly
-            first_brace = ai_response_content.find('[')
-            last_brace = ai_response_content.rfind(']')
-            if first_brace != -1 and last_brace != -1:
-                ai_response_content = ai_response_content[first_brace:last_brace+1]
-            else:
-                print("Warning: Could not find JSON list delimiters in AI response for profiles.")
-
-        ai_response_content = ai_response_content.strip()
-        
         try:
-            parsed_profiles = json.loads(ai_response_content)
-            if not isinstance(parsed_profiles, list):
-                raise ValueError("AI response for profiles was not a JSON list.")
-
-            for item in tqdm(parsed_profiles, desc="Processing Generated Profile Contents", total=len(parsed_profiles)):
-                if isinstance(item, dict) and "name" in item and "title" in item and "bio" in item:
-                    ai_generated_profile_data.append({
-                        "name": str(item["name"]),
-                        "title": str(item["title"]),
-                        "bio": str(item["bio"])
-                    })
-                else:
-                    print(f"Warning: Skipping malformed profile item from AI response: {item}")
-            
-            if not ai_generated_profile_data:
-                 print("Critical Warning: AI returned no validly structured profiles after parsing.")
-                 # raise ValueError("AI returned no valid profiles.") # Or return empty and handle upstream
-            elif len(ai_generated_profile_data) < num_profiles:
-                 print(f"Warning: AI returned {len(ai_generated_profile_data)} valid profiles, but {num_profiles} were requested. Using what was returned.")
-
-        except json.JSONDecodeError as e:
-            print(f"Error: Could not decode JSON from AI profile response: {e}")
-            print("AI response snippet for profiles: ", ai_response_content[:500])
-            return [] 
-        except ValueError as e:
-            print(f"Error: AI profile response validation failed: {e}")
-            return [] 
-            
+            return _parse_generated_profiles(ai_response_content)
+        except (ValueError, KeyError) as e:
+            print(f"Error: AI profile response validation failed ({batch_label}): {e!r}")
     except Exception as e:
-        print(f"An error occurred during Chat API call for profile generation: {e}")
+        print(f"An error occurred during Chat API call for profile generation ({batch_label}): {e}")
+    finally:
+        pbar.update(1)
+    return []
+
+async def _generate_ai_profile_contents_async(num_profiles: int, theme: str, model_name: str,
+                                              rate_limiter: RateLimiter) -> List[Dict]:
+    batch_sizes = [len(batch) for batch in _split_into_batches(range(num_profiles), PROFILES_PER_GENERATION_REQUEST)]
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHAT_REQUESTS)
+    async with create_chat_client() as client:
+        with tqdm(total=len(batch_sizes), desc="Generating Profile Contents (batches)") as pbar:
+            batches = await asyncio.gather(*(
+                _generate_profile_batch(client, semaphore, rate_limiter, pbar, batch_size,
+                                        f"batch {i+1} of {len(batch_sizes)}", theme, model_name)
+                for i, batch_size in enumerate(batch_sizes)
+            ))
+    return [profile for batch in batches for profile in batch]
+
+def generate_ai_profile_contents(num_profiles: int, theme: str, model_name: str,
+                                 rate_limiter: Optional[RateLimiter] = None) -> List[Dict]:
+    """
+    Generates core content (name, title, bio) for fake profiles using the Chat API.
+    Theme describes the type of profiles to generate (e.g., 'students at a tech and finance career fair').
+    Profiles are requested in batches of PROFILES_PER_GENERATION_REQUEST, up to
+    MAX_CONCURRENT_CHAT_REQUESTS at a time and within rate_limiter's limits (defaults from DEFAULT_CONFIG).
+    Returns a list of dicts, each with {"name", "title", "bio"}.
+    """
+    if not DARTMOUTH_CHAT_API_KEY:
+        print("Error: DARTMOUTH_CHAT_API_KEY not set. Cannot perform AI profile generation.")
         return [] 
-    
+
+    print(f"\nAttempting to generate {num_profiles} profile contents using AI (model: {model_name}). Theme: {theme}...")
+    ai_generated_profile_data = asyncio.run(_generate_ai_profile_contents_async(
+        num_profiles, theme, model_name, rate_limiter or create_rate_limiter()))
+
+    if not ai_generated_profile_data:
+         print("Critical Warning: AI returned no validly structured profiles after parsing.")
+    elif len(ai_generated_profile_data) < num_profiles:
+         print(f"Warning: AI returned {len(ai_generated_profile_data)} valid profiles, but {num_profiles} were requested. Using what was returned.")
     return ai_generated_profile_data
 
-def generate_base_profiles_data(num_to_generate: int, model_name: str, theme: str) -> List[Dict]:
+def _new_profile_ids(n: int) -> List[str]:
+    """n random (version 4) UUID strings, drawn from a single os.urandom call instead of one per uuid4()."""
+    rand = os.urandom(16 * n)
+    return [str(uuid.UUID(bytes=rand[i * 16:(i + 1) * 16], version=4)) for i in range(n)]
+
+def generate_base_profiles_data(num_to_generate: int, model_name: str, theme: str,
+                                rate_limiter: Optional[RateLimiter] = None) -> List[Dict]:
     """Generates N fake profiles using AI (or fallback), adds unique IDs."""
-    ai_profiles_core_data = generate_ai_profile_contents(num_to_generate, theme, model_name)
+    ai_profiles_core_data = generate_ai_profile_contents(num_to_generate, theme, model_name, rate_limiter)
     
     final_profiles_with_ids = []
+    profile_ids = _new_profile_ids(len(ai_profiles_core_data) or num_to_generate)
     if not ai_profiles_core_data: # AI generation failed or returned empty
         print("AI profile generation failed or yielded no data. Creating basic placeholder profiles.")
+        from faker import Faker # Imported only here: loading its locale data is slow and usually unneeded
         faker_instance = Faker() # Instantiate Faker only if needed for fallback names
         for i in tqdm(range(num_to_generate), desc="Generating Fallback Profiles"):
             final_profiles_with_ids.append({
-                "id": str(uuid.uuid4()),
+                "id": profile_ids[i],
                 "name": faker_instance.name(), # Use Faker for fallback names
                 "title": "Placeholder Title",
                 "bio": f"This is a placeholder bio for profile {i+1} due to AI profile generation issues."
             })
     else:
-        for core_profile in tqdm(ai_profiles_core_data, desc="Processing AI Profiles"):
+        for profile_id, core_profile in zip(profile_ids, tqdm(ai_profiles_core_data, desc="Processing AI Profiles")):
             final_profiles_with_ids.append({
-                "id": str(uuid.uuid4()), 
+                "id": profile_id,
                 "name": core_profile["name"],
                 "title": core_profile["title"],
                 "bio": core_profile["bio"]
@@ -160,62 +349,87 @@ def generate_base_profiles_data(num_to_generate: int, model_name: str, theme: st
     print(f"Generated {len(final_profiles_with_ids)} base profiles (AI-assisted or fallback).")
     return final_profiles_with_ids
 
-def save_profiles_to_json(profiles: List[Dict], path: str):
-    """Writes profiles to a JSON file."""
+def save_profiles_jsonl(profiles: List[Dict], path: str, append: bool = False):
+    """Writes profiles as JSON Lines, one object per line; append adds to the file without rewriting it."""
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, 'w') as f:
-        json.dump(profiles, f, indent=4)
+    with open(path, 'ab' if append else 'wb') as f:
+        f.writelines(json_dumps(p) + b"\n" for p in profiles)
+
+def save_profiles_to_json(profiles: List[Dict], path: str, pretty: bool = False):
+    """Writes profiles to a JSON file; compact unless pretty is set. A .jsonl path is written as JSON Lines."""
+    if path.endswith(".jsonl"):
+        save_profiles_jsonl(profiles, path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(json_dumps(profiles, indent=pretty))
     print(f"Saved {len(profiles)} profiles to {path}")
 
+# Profile ids are 36-character UUID strings, which always fit version 3 at qrcode.make()'s default
+# error correction (M), so the version search can be skipped
+QR_VERSION = 3
+_qr_encoder = None # One reusable QRCode per process (created lazily, so each pool worker has its own)
+
+def _make_qr_image(qr_data: str):
+    global _qr_encoder
+    if _qr_encoder is None:
+        _qr_encoder = qrcode.QRCode(version=QR_VERSION, error_correction=qrcode.constants.ERROR_CORRECT_M,
+                                    box_size=10, border=4)
+    _qr_encoder.clear()
+    _qr_encoder.add_data(qr_data)
+    try:
+        _qr_encoder.make(fit=False)
+    except qrcode.exceptions.DataOverflowError: # Longer, non-UUID id: let qrcode pick the version
+        return qrcode.make(qr_data)
+    return _qr_encoder.make_image(fill_color="black", back_color="white")
+
+def _make_qr(job: Tuple[str, str]) -> Tuple[str, str, Optional[str]]:
+    """Pool worker: writes the QR code PNG for one profile id. Returns (id, path, error message or None)."""
+    profile_id, out_dir = job
+    file_path = os.path.join(out_dir, f"{profile_id}.png")
+    try:
+        # Fast zlib level: these PNGs are scanning targets, size barely matters
+        _make_qr_image(profile_id).save(file_path, format="PNG", optimize=False, compress_level=1)
+    except Exception as e:
+        return profile_id, file_path, str(e)
+    return profile_id, file_path, None
+
 def generate_qr_codes_for_profiles(profiles: List[Dict], out_dir: str):
-    """Outputs one PNG per profile.id in out_dir."""
+    """Outputs one PNG per profile.id in out_dir, encoding across all CPU cores."""
     os.makedirs(out_dir, exist_ok=True)
     generated_count = 0
     print(f"Generating QR codes in {out_dir}...")
-    for profile in tqdm(profiles, desc="Generating QR Codes"):
+    jobs = []
+    for profile in profiles:
         profile_id = profile.get("id")
         if not profile_id:
             print(f"Skipping QR code generation for profile due to missing ID: {profile.get('name')}")
             continue
-        
-        qr_data = profile_id
-        img = qrcode.make(qr_data)
-        file_path = os.path.join(out_dir, f"{profile_id}.png")
-        try:
-            img.save(file_path)
-            generated_count +=1
-        except Exception as e:
-            print(f"Error saving QR code for ID {profile_id} to {file_path}: {e}")
+        jobs.append((profile_id, out_dir))
+
+    num_workers = min(len(jobs), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=num_workers) if num_workers > 1 else nullcontext() as executor:
+        results = executor.map(_make_qr, jobs, chunksize=max(1, len(jobs) // (num_workers * 4))) if executor else map(_make_qr, jobs)
+        for profile_id, file_path, error in tqdm(results, total=len(jobs), desc="Generating QR Codes"):
+            if error is None:
+                generated_count += 1
+            else:
+                print(f"Error saving QR code for ID {profile_id} to {file_path}: {error}")
     if generated_count > 0:
         print(f"Generated {generated_count} QR codes in {out_dir}")
 
 # --- Phase 2: Calculate Relevance using Chat Completion ---
 
-def get_relevance_with_chat_completion(user_bio: str, profiles_to_evaluate: List[Dict], model_name: str) -> List[Dict]:
-    """
-    Uses Dartmouth Chat Completion API to get relevance scores and explanations for profiles.
-    Returns a list of dicts, each with {"id", "relevance", "relevance_explanation"}.
-    """
-    if not DARTMOUTH_CHAT_API_KEY:
-        print("Error: DARTMOUTH_CHAT_API_KEY not set. Cannot perform AI relevance scoring.")
-        # Return profiles with placeholder relevance if API key is missing
-        return [{"id": p["id"], "relevance": 0.0, "relevance_explanation": "API key missing, relevance not calculated."} for p in profiles_to_evaluate]
-
-    print(f"\nAttempting to get relevance scores for {len(profiles_to_evaluate)} profiles using model: {model_name}...")
-    
-    # Construct the prompt
-    # This prompt needs to be very specific about the output format.
-    profiles_json_for_prompt = json.dumps([{"id": p["id"], "bio": p["bio"]} for p in profiles_to_evaluate], indent=2)
-    
-    system_prompt = f"""
+def _relevance_system_prompt(user_bio: str) -> str:
+    return f"""
     You are an AI assistant helping an event organizer identify relevant people.
     Your task is to evaluate a list of professional profiles based on their bio and compare them to the event organizer's bio.
     For each profile, you must provide a relevance score and a brief explanation.
     
     The event organizer's bio is: "{user_bio}"
     
-    You will be given a JSON list of profiles, each with an "id" and a "bio".
-    You MUST return a single JSON string that is a list of objects. Each object in the list MUST contain:
+    You will be given a JSON list of profiles, each a two-element array [id, bio].
+    You MUST return a single JSON object of the form {{ "results": [...] }}, where "results" is a list of objects. Each object in the list MUST contain:
     1. "id": The original id of the profile.
     2. "relevance": A numerical relevance score from 0.0 (not relevant) to 1.0 (highly relevant).
     3. "relevance_explanation": A short (1-2 sentence) explanation for the score.
@@ -223,114 +437,254 @@ def get_relevance_with_chat_completion(user_bio: str, profiles_to_evaluate: List
     Example of a single profile object in your response list:
     {{ "id": "some-uuid-string", "relevance": 0.85, "relevance_explanation": "This person's expertise in AI aligns well with the organizer's interests." }}
     
-    Ensure your entire output is a valid JSON list of these objects.
+    Ensure your entire output is this JSON object.
     """
-    
+
+def _relevance_request(system_prompt: str, batch: List[Dict], model_name: str) -> Dict:
+    """chat.completions.create() arguments for scoring one batch of profiles."""
+    # Construct the prompt
+    # This prompt needs to be very specific about the output format.
+    # Minified [id, bio] pairs: indentation and repeated "id"/"bio" keys would only add billed prompt tokens
+    profiles_json_for_prompt = json_dumps([(p["id"], p["bio"]) for p in batch]).decode('utf-8')
     user_content = f"Please evaluate the following profiles:\n{profiles_json_for_prompt}"
+    return dict(
+        model=model_name, 
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ],
+        temperature=0.2,
+        response_format={"type": "json_object"}, # Reply is guaranteed to be a JSON object
+    )
+
+def _parse_relevance_reply(ai_response_content: str, batch: List[Dict]) -> List[Dict]:
+    """
+    Validated {"id", "relevance", "relevance_explanation"} entries from a {"results": [...]} reply,
+    with placeholders for profiles of the batch the reply left out.
+    Raises ValueError (incl. json.JSONDecodeError) or KeyError if the reply does not have that shape.
+    """
+    parsed_relevance_list = json_loads(ai_response_content)["results"]
+    if not isinstance(parsed_relevance_list, list):
+        raise ValueError("AI response 'results' was not a JSON list.")
 
-    all_relevance_data = []
+    batch_relevance_data = []
+    # Validate structure of each item
+    for item in parsed_relevance_list:
+        if isinstance(item, dict) and "id" in item and "relevance" in item and "relevance_explanation" in item:
+            batch_relevance_data.append({
+                "id": item["id"],
+                "relevance": float(item["relevance"]),
+                "relevance_explanation": str(item["relevance_explanation"])
+            })
+        else:
+            print(f"Warning: Skipping malformed item from AI response: {item}")
     
+    if len(batch_relevance_data) != len(batch):
+        print(f"Warning: AI returned {len(batch_relevance_data)} valid relevance entries, but {len(batch)} were expected.")
+        print("Missing entries will have placeholder relevance.")
+        # Add placeholders for missing IDs
+        returned_ids = {item["id"] for item in batch_relevance_data}
+        for p_eval in batch:
+            if p_eval["id"] not in returned_ids:
+                batch_relevance_data.append({
+                    "id": p_eval["id"], 
+                    "relevance": 0.0, 
+                    "relevance_explanation": "Relevance data not returned by AI."
+                })
+    return batch_relevance_data
+
+def _placeholder_relevance(batch: List[Dict], explanation: str) -> List[Dict]:
+    return [{"id": p["id"], "relevance": 0.0, "relevance_explanation": explanation} for p in batch]
+
+async def _score_relevance_batch(
+    client: AsyncOpenAI, semaphore: asyncio.Semaphore, rate_limiter: RateLimiter, pbar: tqdm,
+    system_prompt: str, batch: List[Dict], batch_label: str, model_name: str, use_cache: bool
+) -> List[Dict]:
+    """Scores one batch of profiles. Failures only replace this batch's entries with placeholders.
+    A cached reply for the identical request is reused unless use_cache is False (the fresh reply is still cached).
+    """
+    create_kwargs = _relevance_request(system_prompt, batch, model_name)
+    messages = create_kwargs["messages"]
+    est_tokens = (estimate_tokens(messages[0]["content"] + messages[1]["content"], model_name)
+                  + len(batch) * ESTIMATED_COMPLETION_TOKENS_PER_PROFILE)
+    cache_path = _chat_cache_path(create_kwargs)
+
     try:
-        print("Sending request to Chat API. This might take a moment...")
-        # Similar to profile generation, this is a single batch call.
-        # tqdm here reflects the single operation.
-        response = chat_api.chat.completions.create(
-            model=model_name, 
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content}
-            ],
-            temperature=0.2,
-            # response_format={ "type": "json_object" }, # Use if API supports forcing JSON output
-        )
-        
-        ai_response_content = response.choices[0].message.content
-        print("Received response from Chat API.")
+        ai_response_content = _read_chat_cache(cache_path) if use_cache else None
+        from_cache = ai_response_content is not None
+        if not from_cache:
+            response = await _call_chat(client, semaphore, rate_limiter, est_tokens, batch_label, **create_kwargs)
+            ai_response_content = response.choices[0].message.content
         # print("Raw AI Response:\n", ai_response_content) # Uncomment for debugging
 
-        # Attempt to parse the JSON response
-        # The AI might sometimes return a JSON string wrapped in backticks or with leading/trailing text.
-        # Basic cleaning attempt:
-        if ai_response_content.startswith("```json"):
-            ai_response_content = ai_response_content[7:] # Remove ```json
-            if ai_response_content.endswith("```"):
-                ai_response_content = ai_response_content[:-3] # Remove trailing ```
-        ai_response_content = ai_response_content.strip()
-
         try:
-            parsed_relevance_list = json.loads(ai_response_content)
-            if not isinstance(parsed_relevance_list, list):
-                raise ValueError("AI response was not a JSON list.")
-
-            # Validate structure of each item
-            valid_items_count = 0
-            for item in tqdm(parsed_relevance_list, desc="Processing Relevance Scores", total=len(parsed_relevance_list)):
-                if isinstance(item, dict) and "id" in item and "relevance" in item and "relevance_explanation" in item:
-                    all_relevance_data.append({
-                        "id": item["id"],
-                        "relevance": float(item["relevance"]),
-                        "relevance_explanation": str(item["relevance_explanation"])
-                    })
-                    valid_items_count += 1
-                else:
-                    print(f"Warning: Skipping malformed item from AI response: {item}")
-            
-            if valid_items_count != len(profiles_to_evaluate):
-                print(f"Warning: AI returned {valid_items_count} valid relevance entries, but {len(profiles_to_evaluate)} were expected.")
-                print("Missing entries will have placeholder relevance.")
-                # Add placeholders for missing IDs
-                returned_ids = {item["id"] for item in all_relevance_data}
-                for p_eval in profiles_to_evaluate:
-                    if p_eval["id"] not in returned_ids:
-                        all_relevance_data.append({
-                            "id": p_eval["id"], 
-                            "relevance": 0.0, 
-                            "relevance_explanation": "Relevance data not returned by AI."
-                        })
-
-        except json.JSONDecodeError as e:
-            print(f"Error: Could not decode JSON from AI response: {e}")
-            print("AI response was: ", ai_response_content)
-            # Fallback: assign placeholder relevance to all if parsing fails
-            all_relevance_data = [{"id": p["id"], "relevance": 0.0, "relevance_explanation": "AI response parsing failed."} for p in profiles_to_evaluate]
+            batch_relevance_data = _parse_relevance_reply(ai_response_content, batch)
+            if not from_cache:
+                _write_chat_cache(cache_path, ai_response_content) # Only replies that parsed are cached
+        except (ValueError, KeyError) as e:
+            print(f"Error: AI relevance response validation failed ({batch_label}): {e!r}")
+            # Fallback: assign placeholder relevance to the batch if parsing fails
+            batch_relevance_data = _placeholder_relevance(batch, "AI response parsing failed.")
         
     except Exception as e:
         print(f"An error occurred during Chat API call or processing: {e}")
-        # Fallback: assign placeholder relevance to all if API call fails
-        all_relevance_data = [{"id": p["id"], "relevance": 0.0, "relevance_explanation": f"Chat API error: {e}"} for p in profiles_to_evaluate]
+        # Fallback: assign placeholder relevance to the batch if API call fails
+        batch_relevance_data = _placeholder_relevance(batch, f"Chat API error: {e}")
+    finally:
+        pbar.update(1)
+
+    return batch_relevance_data
+
+async def _get_relevance_async(user_bio: str, profiles_to_evaluate: List[Dict], model_name: str,
+                               rate_limiter: RateLimiter, use_cache: bool) -> List[Dict]:
+    system_prompt = _relevance_system_prompt(user_bio)
+    batches = _split_into_batches(profiles_to_evaluate, PROFILES_PER_RELEVANCE_REQUEST)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHAT_REQUESTS)
+    async with create_chat_client() as client:
+        with tqdm(total=len(batches), desc="Scoring Relevance (batches)") as pbar:
+            results = await asyncio.gather(*(
+                _score_relevance_batch(client, semaphore, rate_limiter, pbar, system_prompt, batch,
+                                       f"relevance batch {i+1} of {len(batches)}", model_name, use_cache)
+                for i, batch in enumerate(batches)
+            ))
+    return [item for batch_result in results for item in batch_result]
+
+def get_relevance_with_chat_completion(user_bio: str, profiles_to_evaluate: List[Dict], model_name: str,
+                                       rate_limiter: Optional[RateLimiter] = None, use_cache: bool = True) -> List[Dict]:
+    """
+    Uses Dartmouth Chat Completion API to get relevance scores and explanations for profiles.
+    Profiles are scored in batches of PROFILES_PER_RELEVANCE_REQUEST, up to
+    MAX_CONCURRENT_CHAT_REQUESTS at a time and within rate_limiter's limits (defaults from DEFAULT_CONFIG).
+    Batches answered before with the same inputs are read from CHAT_CACHE_DIR unless use_cache is False.
+    Returns a list of dicts, each with {"id", "relevance", "relevance_explanation"}.
+    """
+    if not DARTMOUTH_CHAT_API_KEY:
+        print("Error: DARTMOUTH_CHAT_API_KEY not set. Cannot perform AI relevance scoring.")
+        # Return profiles with placeholder relevance if API key is missing
+        return _placeholder_relevance(profiles_to_evaluate, "API key missing, relevance not calculated.")
+
+    print(f"\nAttempting to get relevance scores for {len(profiles_to_evaluate)} profiles using model: {model_name}...")
+    return asyncio.run(_get_relevance_async(user_bio, profiles_to_evaluate, model_name,
+                                            rate_limiter or create_rate_limiter(), use_cache))
+
+# --- Phase 2 (offline alternative): OpenAI Batch API ---
+BATCH_API_POLL_INTERVAL_S = 60
+BATCH_API_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+async def _get_relevance_batch_api_async(user_bio: str, profiles_to_evaluate: List[Dict], model_name: str,
+                                         use_cache: bool) -> List[Dict]:
+    system_prompt = _relevance_system_prompt(user_bio)
+    batches = _split_into_batches(profiles_to_evaluate, PROFILES_PER_RELEVANCE_REQUEST)
+    requests = [_relevance_request(system_prompt, batch, model_name) for batch in batches]
+    cache_paths = [_chat_cache_path(create_kwargs) for create_kwargs in requests]
+    replies: Dict[int, str] = {}
+    if use_cache:
+        for i, cache_path in enumerate(cache_paths):
+            cached = _read_chat_cache(cache_path)
+            if cached is not None:
+                replies[i] = cached
+    pending = [i for i in range(len(batches)) if i not in replies]
+    errors: Dict[int, str] = {}
 
-    return all_relevance_data
+    if pending:
+        # One JSONL line per profile batch; custom_id maps results back to their batch
+        batch_input = b"".join(
+            json_dumps({"custom_id": str(i), "method": "POST", "url": "/v1/chat/completions", "body": requests[i]}) + b"\n"
+            for i in pending)
+        try:
+            async with create_chat_client() as client:
+                input_file = await client.files.create(file=("relevance_batch.jsonl", batch_input), purpose="batch")
+                job = await client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                                                  completion_window="24h")
+                print(f"Submitted Batch API job {job.id} with {len(pending)} requests. Polling every {BATCH_API_POLL_INTERVAL_S}s...")
+                while job.status not in BATCH_API_TERMINAL_STATUSES:
+                    await asyncio.sleep(BATCH_API_POLL_INTERVAL_S)
+                    job = await client.batches.retrieve(job.id)
+                    print(f"Batch API job {job.id}: {job.status} ({job.request_counts.completed if job.request_counts else '?'}/{len(pending)} done)")
+                if job.output_file_id:
+                    output = await client.files.content(job.output_file_id)
+                    for line in output.content.splitlines():
+                        if not line.strip():
+                            continue
+                        result = json_loads(line)
+                        i = int(result["custom_id"])
+                        response = result.get("response") or {}
+                        if response.get("status_code") == 200:
+                            replies[i] = response["body"]["choices"][0]["message"]["content"]
+                        else:
+                            errors[i] = str(result.get("error") or response.get("body"))
+                if job.status != "completed":
+                    print(f"Error: Batch API job {job.id} ended with status '{job.status}'.")
+        except Exception as e:
+            print(f"An error occurred during Batch API processing: {e}")
+            for i in pending:
+                errors.setdefault(i, f"Batch API error: {e}")
+
+    relevance_data = []
+    for i, batch in enumerate(tqdm(batches, desc="Parsing Batch API Results")):
+        if i not in replies:
+            relevance_data.extend(_placeholder_relevance(batch, errors.get(i, "Batch API returned no result for this request.")))
+            continue
+        try:
+            relevance_data.extend(_parse_relevance_reply(replies[i], batch))
+            if i in pending:
+                _write_chat_cache(cache_paths[i], replies[i])
+        except (ValueError, KeyError) as e:
+            print(f"Error: AI relevance response validation failed (relevance batch {i+1} of {len(batches)}): {e!r}")
+            relevance_data.extend(_placeholder_relevance(batch, "AI response parsing failed."))
+    return relevance_data
+
+def get_relevance_with_batch_api(user_bio: str, profiles_to_evaluate: List[Dict], model_name: str,
+                                 use_cache: bool = True) -> List[Dict]:
+    """
+    Same result as get_relevance_with_chat_completion, but submits all profile batches as one
+    OpenAI Batch API job (cheaper, separate rate limits, up to 24h turnaround) and polls it
+    every BATCH_API_POLL_INTERVAL_S seconds. For large offline runs; the endpoint must support /batches.
+    """
+    if not DARTMOUTH_CHAT_API_KEY:
+        print("Error: DARTMOUTH_CHAT_API_KEY not set. Cannot perform AI relevance scoring.")
+        return _placeholder_relevance(profiles_to_evaluate, "API key missing, relevance not calculated.")
+
+    print(f"\nSubmitting relevance scoring for {len(profiles_to_evaluate)} profiles to the Batch API using model: {model_name}...")
+    return asyncio.run(_get_relevance_batch_api_async(user_bio, profiles_to_evaluate, model_name, use_cache))
 
 def merge_profile_data(base_profiles: List[Dict], relevance_data: List[Dict]) -> List[Dict]:
-    """Merges base profile info with relevance data."""
-    merged_profiles = []
+    """Merges relevance data into the base profiles in place (no per-profile copies) and returns them."""
     relevance_map = {r["id"]: r for r in relevance_data}
     
     for bp in tqdm(base_profiles, desc="Merging Profile Data"):
-        profile_id = bp["id"]
-        merged_profile = bp.copy()
-        if profile_id in relevance_map:
-            merged_profile["relevance"] = relevance_map[profile_id].get("relevance", 0.0)
-            merged_profile["relevance_explanation"] = relevance_map[profile_id].get("relevance_explanation", "N/A")
+        relevance_entry = relevance_map.get(bp["id"]) # Single lookup per profile
+        if relevance_entry is not None:
+            bp["relevance"] = relevance_entry.get("relevance", 0.0)
+            bp["relevance_explanation"] = relevance_entry.get("relevance_explanation", "N/A")
         else:
             # This case should ideally be handled by placeholders in get_relevance_with_chat_completion
-            merged_profile["relevance"] = 0.0
-            merged_profile["relevance_explanation"] = "Relevance data missing for this ID."
-        merged_profiles.append(merged_profile)
-    return merged_profiles
+            bp["relevance"] = 0.0
+            bp["relevance_explanation"] = "Relevance data missing for this ID."
+    return base_profiles
 
 # --- Main execution for prepare_data.py (Updated) ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate profiles, QR codes and relevance scores.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"Ignore cached Chat API relevance replies in {CHAT_CACHE_DIR} (fresh replies still refresh the cache)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Score relevance through the Batch API (one offline job, polled until done) instead of live calls")
+    args = parser.parse_args()
+
     print("--- Starting Data Preparation Process ---")
     
     # Load configuration from utils.py
     app_config = load_config()
-    USER_BIO_FOR_RELEVANCE = app_config.get("USER_BIO")
-    NUM_PROFILES = app_config.get("NUM_PROFILES_TO_GENERATE", 20)
-    BASE_PROFILES_PATH = app_config.get("BASE_PROFILES_JSON_PATH")
-    QR_CODES_OUTPUT_DIR = app_config.get("QR_CODES_DIR")
-    FINAL_PROFILES_WITH_RELEVANCE_PATH = app_config.get("PROFILES_JSON_PATH")
-    CHAT_MODEL = app_config.get("CHAT_MODEL_NAME")
+    USER_BIO_FOR_RELEVANCE = app_config.USER_BIO
+    NUM_PROFILES = app_config.NUM_PROFILES_TO_GENERATE
+    BASE_PROFILES_PATH = app_config.BASE_PROFILES_JSON_PATH
+    QR_CODES_OUTPUT_DIR = app_config.QR_CODES_DIR
+    FINAL_PROFILES_WITH_RELEVANCE_PATH = app_config.PROFILES_JSON_PATH
+    CHAT_MODEL = app_config.CHAT_MODEL_NAME
+    PRETTY_JSON = app_config.PRETTY_JSON
+    # Shared by both phases, so the limits hold across the whole run
+    chat_rate_limiter = create_rate_limiter(app_config.CHAT_REQUESTS_PER_MINUTE, app_config.CHAT_TOKENS_PER_MINUTE)
     PROFILE_GENERATION_THEME = "students and recent graduates attending a career fair for tech and finance internships"
 
     print("\n--- Phase 1: Generating Base Profiles and QR Codes ---")
@@ -338,23 +692,28 @@ if __name__ == "__main__":
     
     if os.path.exists(BASE_PROFILES_PATH) and os.path.getsize(BASE_PROFILES_PATH) > 0:
         print(f"Found existing base profiles at {BASE_PROFILES_PATH}. Loading them.")
-        with open(BASE_PROFILES_PATH, 'r') as f:
-            base_profiles = json.load(f)
+        if BASE_PROFILES_PATH.endswith(".jsonl"):
+            base_profiles = list(load_profiles_jsonl(BASE_PROFILES_PATH))
+        else:
+            with open(BASE_PROFILES_PATH, 'rb') as f:
+                base_profiles = json_loads(f.read())
         if len(base_profiles) != NUM_PROFILES:
             print(f"Warning: Existing base profiles count ({len(base_profiles)}) differs from configured NUM_PROFILES_TO_GENERATE ({NUM_PROFILES}). Re-generating.")
-            base_profiles = generate_base_profiles_data(NUM_PROFILES, CHAT_MODEL, PROFILE_GENERATION_THEME)
-            save_profiles_to_json(base_profiles, BASE_PROFILES_PATH)
+            base_profiles = generate_base_profiles_data(NUM_PROFILES, CHAT_MODEL, PROFILE_GENERATION_THEME, chat_rate_limiter)
+            save_profiles_to_json(base_profiles, BASE_PROFILES_PATH, PRETTY_JSON)
         
-        if not os.listdir(QR_CODES_OUTPUT_DIR) or any(p["id"] not in [f.split('.')[0] for f in os.listdir(QR_CODES_OUTPUT_DIR)] for p in base_profiles):
+        # List the directory once; the per-profile membership test is then O(1)
+        existing_qr_ids = {f.split('.')[0] for f in os.listdir(QR_CODES_OUTPUT_DIR)}
+        if not existing_qr_ids or not all(p["id"] in existing_qr_ids for p in base_profiles):
              print(f"QR codes directory {QR_CODES_OUTPUT_DIR} is empty or seems inconsistent. Regenerating QR codes.")
              generate_qr_codes_for_profiles(base_profiles, QR_CODES_OUTPUT_DIR)
         else:
             print(f"QR codes seem to exist and match base profiles in {QR_CODES_OUTPUT_DIR}. Skipping QR regeneration.")
     else:
         print(f"{BASE_PROFILES_PATH} not found or empty. Generating new base profiles and QR codes.")
-        base_profiles = generate_base_profiles_data(NUM_PROFILES, CHAT_MODEL, PROFILE_GENERATION_THEME)
+        base_profiles = generate_base_profiles_data(NUM_PROFILES, CHAT_MODEL, PROFILE_GENERATION_THEME, chat_rate_limiter)
         if base_profiles:
-            save_profiles_to_json(base_profiles, BASE_PROFILES_PATH)
+            save_profiles_to_json(base_profiles, BASE_PROFILES_PATH, PRETTY_JSON)
             generate_qr_codes_for_profiles(base_profiles, QR_CODES_OUTPUT_DIR)
         else:
             print("Error: No base profiles generated. Halting.")
@@ -371,13 +730,18 @@ if __name__ == "__main__":
         print("Error: USER_BIO not found in configuration. Cannot calculate relevance.")
         exit()
 
-    relevance_results = get_relevance_with_chat_completion(USER_BIO_FOR_RELEVANCE, base_profiles, CHAT_MODEL)
+    if args.batch:
+        relevance_results = get_relevance_with_batch_api(USER_BIO_FOR_RELEVANCE, base_profiles, CHAT_MODEL,
+                                                         use_cache=not args.no_cache)
+    else:
+        relevance_results = get_relevance_with_chat_completion(USER_BIO_FOR_RELEVANCE, base_profiles, CHAT_MODEL, chat_rate_limiter,
+                                                               use_cache=not args.no_cache)
     phase_pbar.update(1) # Phase 2 complete
     phase_pbar.set_description("Phase 2 Complete")
     
     print("\n--- Phase 3: Merging and Saving Final Profiles with Relevance ---")
     final_profiles = merge_profile_data(base_profiles, relevance_results)
-    save_profiles_to_json(final_profiles, FINAL_PROFILES_WITH_RELEVANCE_PATH)
+    save_profiles_to_json(final_profiles, FINAL_PROFILES_WITH_RELEVANCE_PATH, PRETTY_JSON)
     phase_pbar.update(1) # Phase 3 complete
     phase_pbar.set_description("Data Preparation Finished")
     phase_pbar.close()
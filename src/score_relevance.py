@@ -1,8 +1,12 @@
 import json
 import os
-# import numpy as np # No longer needed for cosine similarity here
+import numpy as np # Score arrays for vectorized ranking
+try:
+    import orjson # Faster profile file parsing; stdlib json is the fallback
+except ImportError:
+    orjson = None
 # from sklearn.metrics.pairwise import cosine_similarity # No longer needed
-from typing import List, Dict, Tuple
+from typing import Iterator, List, Dict, Optional, Tuple
 
 # Dartmouth Chat API related imports are no longer needed here as relevance is pre-calculated
 # import httpx 
@@ -17,12 +21,24 @@ from typing import List, Dict, Tuple
 # )
 # USER_BIO_PLACEHOLDER = "..." # No longer needed
 
+def load_profiles_jsonl(path: str) -> Iterator[Dict]:
+    """Lazily parses a JSON Lines profiles file (one profile object per line, blank lines skipped)."""
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
 def load_profiles(path: str) -> Dict[str, Dict]:
-    """Reads profiles file (e.g., profile_relevance.json) into dict keyed by id."""
+    """Reads profiles file (e.g., profile_relevance.json, or a .jsonl file) into dict keyed by id."""
     profiles_dict = {}
     try:
-        with open(path, 'r') as f:
-            profiles_list = json.load(f)
+        if path.endswith(".jsonl"):
+            profiles_list = load_profiles_jsonl(path) # Parsed line by line inside the loop below
+        else:
+            with open(path, 'rb') as f:
+                raw = f.read()
+            profiles_list = orjson.loads(raw) if orjson is not None else json.loads(raw)
         for profile in profiles_list:
             if "id" in profile:
                 # Ensure essential fields for ranking and annotation are present
@@ -41,7 +57,7 @@ def load_profiles(path: str) -> Dict[str, Dict]:
     except FileNotFoundError:
         print(f"Error: Profiles file not found at {path}. Returning empty dictionary.")
         return {}
-    except json.JSONDecodeError:
+    except json.JSONDecodeError: # orjson.JSONDecodeError is a subclass
         print(f"Error: Could not decode JSON from {path}. Returning empty dictionary.")
         return {}
     except Exception as e:
@@ -52,6 +68,39 @@ def load_profiles(path: str) -> Dict[str, Dict]:
 # get_embedding_for_scorer function is removed as it's no longer needed.
 # get_user_embedding function is removed as it's no longer needed for runtime scoring.
 
+def _relevance_score(pid: str, profile: Dict) -> Optional[float]:
+    """The profile's 'relevance' as a float, or None (with a warning) if it is missing or not numeric."""
+    if "relevance" not in profile:
+        print(f"Warning: Profile ID {pid} found but has no 'relevance' score. Skipping.")
+        return None
+    try:
+        return float(profile["relevance"])
+    except (TypeError, ValueError):
+        print(f"Warning: Profile ID {pid} has a non-numeric 'relevance' score ({profile['relevance']!r}). Skipping.")
+        return None
+
+def _slice_top_k(num_candidates: int, top_k: int) -> int:
+    """How many results sorted_list[:top_k] keeps from num_candidates (a negative top_k counts
+    from the end, as in slicing). Shared by rank_profiles and rank_profiles_indexed."""
+    if top_k < 0:
+        return max(0, num_candidates + top_k)
+    return min(top_k, num_candidates)
+
+def _top_k_order(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the top_k highest scores, highest first, in O(n + k log k).
+    Ties keep their original order, exactly like a stable descending sort truncated to top_k.
+    """
+    if top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+    selected = np.arange(scores.size)
+    if top_k < scores.size:
+        # Keep everything above the k-th largest score, plus the earliest entries tied with it
+        kth = np.partition(scores, scores.size - top_k)[scores.size - top_k]
+        above = np.flatnonzero(scores > kth)
+        tied = np.flatnonzero(scores == kth)[:top_k - above.size]
+        selected = np.sort(np.concatenate((above, tied)))
+    return selected[np.argsort(-scores[selected], kind="stable")]
+
 def rank_profiles(
     # user_emb: List[float], # No longer needed
     detected_ids: List[str],
@@ -72,23 +121,67 @@ def rank_profiles(
     candidate_profiles_with_scores = []
     for pid in detected_ids:
         if pid in all_profiles_data:
-            profile = all_profiles_data[pid]
             # The 'relevance' field is expected to be directly in the profile data
-            if "relevance" in profile:
-                candidate_profiles_with_scores.append((pid, float(profile["relevance"])))
-            else:
-                print(f"Warning: Profile ID {pid} found but has no 'relevance' score. Skipping.")
+            score = _relevance_score(pid, all_profiles_data[pid])
+            if score is not None:
+                candidate_profiles_with_scores.append((pid, score))
         else:
             print(f"Warning: Detected profile ID {pid} not found in loaded profiles data. Skipping.")
 
     if not candidate_profiles_with_scores:
         print("No candidate profiles with relevance scores to rank.")
         return []
+    top_k = _slice_top_k(len(candidate_profiles_with_scores), top_k) # Same as slicing a sorted list with [:top_k]
+    if top_k <= 0:
+        return []
+
+    # Top-k by relevance score in descending order (partial selection, not a full sort)
+    scores = np.fromiter((score for _, score in candidate_profiles_with_scores),
+                         dtype=np.float64, count=len(candidate_profiles_with_scores))
+    return [candidate_profiles_with_scores[i] for i in _top_k_order(scores, top_k).tolist()]
+
+ScoreIndex = Tuple[Dict[str, int], List[str], np.ndarray] # (id_to_idx, profile_ids, scores)
+
+def build_score_index(all_profiles_data: Dict[str, Dict]) -> ScoreIndex:
+    """Packs the profiles' relevance scores into an array once, for rank_profiles_indexed.
+    Profiles without a numeric 'relevance' score are left out (with a warning), as rank_profiles
+    would skip them.
+    """
+    profile_ids, score_list = [], []
+    for pid, profile in all_profiles_data.items():
+        score = _relevance_score(pid, profile)
+        if score is not None:
+            profile_ids.append(pid)
+            score_list.append(score)
+    id_to_idx = {pid: idx for idx, pid in enumerate(profile_ids)}
+    return id_to_idx, profile_ids, np.array(score_list, dtype=np.float64)
+
+def rank_profiles_indexed(detected_ids: List[str], score_index: ScoreIndex, top_k: int) -> List[Tuple[str, float]]:
+    """Same result as rank_profiles, using a numpy gather and partial selection over
+    a prebuilt build_score_index instead of per-id dict lookups and a full sort.
+    """
+    if not detected_ids:
+        print("No detected IDs provided. Nothing to rank.")
+        return []
+    id_to_idx, profile_ids, scores = score_index
+    if not profile_ids:
+        print("Profiles data is empty. Cannot rank.")
+        return []
 
-    # Sort by relevance score in descending order
-    candidate_profiles_with_scores.sort(key=lambda x: x[1], reverse=True)
+    for pid in detected_ids:
+        if pid not in id_to_idx:
+            print(f"Warning: Detected profile ID {pid} not found in loaded profiles data (or has no numeric 'relevance' score). Skipping.")
+    idxs = np.fromiter((id_to_idx[pid] for pid in detected_ids if pid in id_to_idx), dtype=np.int64)
+    if idxs.size == 0:
+        print("No candidate profiles with relevance scores to rank.")
+        return []
+    top_k = _slice_top_k(idxs.size, top_k) # Same convention as rank_profiles
+    if top_k <= 0:
+        return []
 
-    return candidate_profiles_with_scores[:top_k]
+    candidate_scores = scores[idxs]
+    order = _top_k_order(candidate_scores, top_k)
+    return [(profile_ids[idxs[i]], float(candidate_scores[i])) for i in order.tolist()]
 
 
 if __name__ == '__main__':
@@ -97,8 +190,8 @@ if __name__ == '__main__':
     # Load configuration to get the path for profile_relevance.json
     from src.utils import load_config # Import here for testing scope
     config = load_config()
-    PROFILES_JSON_PATH = config.get("PROFILES_JSON_PATH") # Should be data/profile_relevance.json
-    TOP_K_RESULTS = config.get("TOP_K_RESULTS", 3)
+    PROFILES_JSON_PATH = config.PROFILES_JSON_PATH # Should be data/profile_relevance.json
+    TOP_K_RESULTS = config.TOP_K_RESULTS
 
     if not PROFILES_JSON_PATH:
         print("Error: PROFILES_JSON_PATH not set in config. Cannot run test.")
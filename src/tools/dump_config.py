@@ -0,0 +1,16 @@
+# src/tools/dump_config.py
+
+# Prints the resolved configuration (config.json merged with defaults).
+# Usage, from the project root: python -m src.tools.dump_config
+# Note: like load_config() everywhere else, this creates config.json with defaults if it is missing.
+import logging
+
+from src.utils import CONFIG_FILE_PATH, load_config
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    cfg = load_config()
+    print("\nLoaded configuration:")
+    for key, value in cfg._asdict().items():
+        print(f"  {key}: {value}")
+    print(f"Values above are from {CONFIG_FILE_PATH} merged with defaults.")
@@ -5,85 +5,220 @@
 
 # Example: Configuration loading (can be expanded)
 import json
+import logging
 import os
+import stat
+import tempfile
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple, Union
 
-DEFAULT_CONFIG = {
-    "TOP_K_RESULTS": 3,
-    "USER_BIO": "Dartmouth Computer Science sophomore actively seeking a challenging Software Engineering internship for Summer 2025. Proficient in Python, Java, and C++, with hands-on experience in web development (React, Node.js) through personal projects and coursework. Strong interest in machine learning and data analysis. Eager to contribute to innovative projects and learn from experienced engineers. Active member of the Dartmouth Coding Club, recently collaborated on developing a campus utility mobile application.",
-    "PROFILES_JSON_PATH": "data/profile_relevance.json",
-    "BASE_PROFILES_JSON_PATH": "data/base_profiles.json",
-    "QR_CODES_DIR": "data/qr_codes/",
-    "INPUT_IMAGE_PATH": "assets/sample_group.jpg", # Can be a file or a directory
-    "OUTPUT_IMAGE_DIR": "assets/annotated_images/", # Changed from OUTPUT_IMAGE_PATH
-    "NUM_PROFILES_TO_GENERATE": 20,
-    "SAMPLE_IMAGES_DIR": "assets/sample_test_images/",
-    "CHAT_MODEL_NAME": "anthropic.claude-3-7-sonnet-20250219"
-}
+class Config(NamedTuple):
+    """Resolved configuration: defaults overridden by config.json. Immutable, with attribute access
+    (cfg.TOP_K_RESULTS); the field defaults below are the default config."""
+    TOP_K_RESULTS: int = 3
+    USER_BIO: str = "Dartmouth Computer Science sophomore actively seeking a challenging Software Engineering internship for Summer 2025. Proficient in Python, Java, and C++, with hands-on experience in web development (React, Node.js) through personal projects and coursework. Strong interest in machine learning and data analysis. Eager to contribute to innovative projects and learn from experienced engineers. Active member of the Dartmouth Coding Club, recently collaborated on developing a campus utility mobile application."
+    PROFILES_JSON_PATH: str = "data/profile_relevance.json"
+    BASE_PROFILES_JSON_PATH: str = "data/base_profiles.json" # Profile files may also be .jsonl (JSON Lines)
+    QR_CODES_DIR: str = "data/qr_codes/"
+    INPUT_IMAGE_PATH: str = "assets/sample_group.jpg" # Can be a file or a directory
+    OUTPUT_IMAGE_DIR: str = "assets/annotated_images/" # Changed from OUTPUT_IMAGE_PATH
+    NUM_PROFILES_TO_GENERATE: int = 20
+    SAMPLE_IMAGES_DIR: str = "assets/sample_test_images/"
+    CHAT_MODEL_NAME: str = "anthropic.claude-3-7-sonnet-20250219"
+    CHAT_REQUESTS_PER_MINUTE: int = 60 # Client-side rate limits for the Chat API (see prepare_data.RateLimiter)
+    CHAT_TOKENS_PER_MINUTE: int = 100000
+    PRETTY_JSON: bool = False # Indent the generated profile files (for reading them by hand)
+
+    def get(self, key: str, default=None):
+        """dict-style lookup, for callers that address settings by key name."""
+        return getattr(self, key) if key in self._fields else default
+
+DEFAULT_CONFIG = Config()
+
+log = logging.getLogger(__name__)
 
 CONFIG_FILE_PATH = "config.json"
 
-def load_config() -> dict:
-    """Loads configuration from a JSON file, falling back to defaults."""
-    config = DEFAULT_CONFIG.copy() # Start with defaults
+# (legacy key, replacement key, converter from the legacy value; a falsy result means not convertible)
+_LEGACY_KEY_MIGRATIONS = (
+    # A file path like "dir/file.jpg" gives its directory; a bare "file.jpg" gives "" (not convertible)
+    ("OUTPUT_IMAGE_PATH", "OUTPUT_IMAGE_DIR", os.path.dirname),
+)
+
+@lru_cache(maxsize=1)
+def _orjson():
+    """orjson (faster config parsing) or None to use stdlib json. Imported on first use, so
+    importing this module just for Config/DEFAULT_CONFIG does not load it."""
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+# Last parsed configuration and the config.json mtime (ns) it reflects
+_CONFIG_CACHE = {"mtime_ns": None, "value": None}
 
-    if os.path.exists(CONFIG_FILE_PATH):
+# Output directories created once at config-load time, so writers don't need their own makedirs
+_OUTPUT_DIR_KEYS = ("OUTPUT_IMAGE_DIR", "QR_CODES_DIR", "SAMPLE_IMAGES_DIR")
+_dirs_ensured = False
+
+def _ensure_output_dirs(config: Config):
+    global _dirs_ensured
+    for key in _OUTPUT_DIR_KEYS:
+        path = getattr(config, key)
+        if not path:
+            continue
         try:
-            with open(CONFIG_FILE_PATH, 'r') as f:
-                user_config = json.load(f)
-            
-            # Handle transition from OUTPUT_IMAGE_PATH to OUTPUT_IMAGE_DIR
-            if "OUTPUT_IMAGE_DIR" not in user_config and "OUTPUT_IMAGE_PATH" in user_config:
-                legacy_output_path = user_config.pop("OUTPUT_IMAGE_PATH") # Remove old key
-                derived_output_dir = os.path.dirname(legacy_output_path)
-                if derived_output_dir: # If it was a path like "dir/file.jpg"
-                    user_config["OUTPUT_IMAGE_DIR"] = derived_output_dir
-                    print(f"Warning: Legacy key 'OUTPUT_IMAGE_PATH' ('{legacy_output_path}') found in {CONFIG_FILE_PATH}. "
-                          f"Using its directory '{derived_output_dir}' for 'OUTPUT_IMAGE_DIR'. "
-                          f"Please update {CONFIG_FILE_PATH} to use 'OUTPUT_IMAGE_DIR' directly.")
-                else: # If it was like "file.jpg" or empty, dirname is empty. Default OUTPUT_IMAGE_DIR will be used.
-                    print(f"Warning: Legacy key 'OUTPUT_IMAGE_PATH' ('{legacy_output_path}') found in {CONFIG_FILE_PATH} "
-                          f"could not be reliably converted to a directory. "
-                          f"Please set 'OUTPUT_IMAGE_DIR' in {CONFIG_FILE_PATH}.")
-            
-            config.update(user_config) # Apply user's config over defaults
-            print(f"Loaded configuration from {CONFIG_FILE_PATH}")
-        except Exception as e:
-            print(f"Error loading {CONFIG_FILE_PATH}: {e}. Using default config values where applicable.")
-    else:
-        print(f"Config file {CONFIG_FILE_PATH} not found. Using default config and creating the file.")
-        save_config(config, CONFIG_FILE_PATH) # Save the initial default config
+            os.makedirs(path, exist_ok=True)
+        except OSError as e:
+            log.error("Could not create %s directory %s: %s", key, path, e)
+    _dirs_ensured = True
+
+def _config_mtime_ns() -> Optional[int]:
+    try:
+        return os.stat(CONFIG_FILE_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def load_config() -> Config:
+    """Loads configuration from a JSON file, falling back to defaults.
+    The parsed result is cached: later calls cost one stat() and only re-read the file if its
+    mtime changed. The output directories (OUTPUT_IMAGE_DIR, QR_CODES_DIR, SAMPLE_IMAGES_DIR)
+    are created here as well.
+    """
+    mtime_ns = _config_mtime_ns()
+    if _CONFIG_CACHE["value"] is not None and mtime_ns is not None and mtime_ns == _CONFIG_CACHE["mtime_ns"]:
+        return _CONFIG_CACHE["value"]
+    previous = _CONFIG_CACHE["value"]
+    config, mtime_ns = _read_config()
+    _CONFIG_CACHE["mtime_ns"], _CONFIG_CACHE["value"] = mtime_ns, config
+    # Once per process, plus whenever an edited config.json points at different directories
+    if not _dirs_ensured or previous is None or any(getattr(config, k) != getattr(previous, k) for k in _OUTPUT_DIR_KEYS):
+        _ensure_output_dirs(config)
     return config
 
-def save_config(config: dict, path: str = CONFIG_FILE_PATH):
-    """Saves the current configuration to a JSON file."""
+def _read_config() -> Tuple[Config, Optional[int]]:
+    """Parses config.json over the defaults; also returns the mtime (ns) of the file that was read."""
+    config = DEFAULT_CONFIG
+    mtime_ns = None
+
     try:
-        with open(path, 'w') as f:
-            json.dump(config, f, indent=4)
-        print(f"Saved configuration to {path}")
+        with open(CONFIG_FILE_PATH, 'rb') as f:
+            mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+            raw = f.read()
+        orjson = _orjson()
+        user_config = orjson.loads(raw) if orjson is not None else json.loads(raw)
+        
+        # Rename legacy keys (e.g. OUTPUT_IMAGE_PATH -> OUTPUT_IMAGE_DIR)
+        for legacy_key, new_key, convert in _LEGACY_KEY_MIGRATIONS:
+            if legacy_key in user_config and new_key not in user_config:
+                legacy_value = user_config.pop(legacy_key) # Remove old key
+                new_value = convert(legacy_value)
+                if new_value:
+                    user_config[new_key] = new_value
+                    log.warning("Legacy key '%s' ('%s') found in %s. Using '%s' for '%s'. Please update %s to use '%s' directly.",
+                                legacy_key, legacy_value, CONFIG_FILE_PATH, new_value, new_key, CONFIG_FILE_PATH, new_key)
+                else: # Not convertible; the default for new_key will be used
+                    log.warning("Legacy key '%s' ('%s') found in %s could not be reliably converted. Please set '%s' in %s.",
+                                legacy_key, legacy_value, CONFIG_FILE_PATH, new_key, CONFIG_FILE_PATH)
+        
+        unknown_keys = [k for k in user_config if k not in Config._fields]
+        if unknown_keys:
+            log.warning("Ignoring unknown key(s) in %s: %s", CONFIG_FILE_PATH, ", ".join(unknown_keys))
+        config = DEFAULT_CONFIG._replace(**{k: v for k, v in user_config.items() if k in Config._fields}) # Apply user's config over defaults
+        log.info("Loaded configuration from %s", CONFIG_FILE_PATH)
+    except FileNotFoundError: # One open() instead of exists() + open()
+        log.warning("Config file %s not found. Using default config and creating the file.", CONFIG_FILE_PATH)
+        save_config(config, CONFIG_FILE_PATH) # Save the initial default config
+        mtime_ns = _config_mtime_ns() # The file just written holds exactly these defaults
+    except Exception as e:
+        log.error("Error loading %s: %s. Using default config values where applicable.", CONFIG_FILE_PATH, e)
+    return config, mtime_ns
+
+@lru_cache(maxsize=1)
+def _ijson():
+    """ijson (optional streaming JSON parser) or None if not installed."""
+    try:
+        import ijson
+    except ImportError:
+        return None
+    return ijson
+
+def get_config_key(key: str, default=None):
+    """
+    Value of a single config key, for tools that need just one setting; the same value
+    load_config() would give (legacy keys migrated, defaults filled in). Keys that are not
+    Config fields return default.
+    With ijson installed, config.json is scanned as a stream without building the whole dict
+    (e.g. the long USER_BIO). Otherwise, or if the full config is already loaded, this is
+    load_config().get(). Unlike load_config(), a missing config.json is not created here.
+    """
+    if key not in Config._fields:
+        return default
+    ijson = _ijson()
+    if ijson is None or _CONFIG_CACHE["value"] is not None:
+        return load_config().get(key)
+    # Legacy keys that migrate to this key, with their converters
+    legacy = {legacy_key: convert for legacy_key, new_key, convert in _LEGACY_KEY_MIGRATIONS if new_key == key}
+    legacy_found = None
+    try:
+        with open(CONFIG_FILE_PATH, 'rb') as f:
+            for found_key, value in ijson.kvitems(f, '', use_float=True):
+                if found_key == key:
+                    return value
+                if found_key in legacy and legacy_found is None:
+                    legacy_found = (found_key, value)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log.error("Error reading '%s' from %s: %s. Using the default value.", key, CONFIG_FILE_PATH, e)
+        return getattr(DEFAULT_CONFIG, key)
+    if legacy_found is not None: # The key itself is absent, so the legacy value applies (as in load_config)
+        legacy_key, legacy_value = legacy_found
+        new_value = legacy[legacy_key](legacy_value)
+        if new_value:
+            log.warning("Legacy key '%s' ('%s') found in %s. Using '%s' for '%s'. Please update %s to use '%s' directly.",
+                        legacy_key, legacy_value, CONFIG_FILE_PATH, new_value, key, CONFIG_FILE_PATH, key)
+            return new_value
+    return getattr(DEFAULT_CONFIG, key)
+
+def reload_config() -> Config:
+    """Drops the cached configuration and loads it from disk again."""
+    _CONFIG_CACHE["mtime_ns"] = _CONFIG_CACHE["value"] = None
+    return load_config()
+
+def save_config(config: Union[Config, dict], path: str = CONFIG_FILE_PATH):
+    """Saves the current configuration to a JSON file (atomically replacing it), unless the file already matches."""
+    if isinstance(config, Config):
+        config = config._asdict()
+    try:
+        orjson = _orjson()
+        if orjson is not None:
+            payload = orjson.dumps(config, option=orjson.OPT_INDENT_2)
+        else:
+            payload = json.dumps(config, indent=2, ensure_ascii=False).encode('utf-8')
+        try: # Nothing to do if the file already holds exactly this content (e.g. another process just wrote it)
+            with open(path, 'rb') as f:
+                if f.read() == payload:
+                    log.info("Configuration at %s is already up to date", path)
+                    return
+        except FileNotFoundError:
+            pass
+        # Write a temp file next to the target and rename it over, so a crash mid-write
+        # never leaves a truncated config.json behind
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.cfg', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            try: # mkstemp creates the file 0600; keep the permissions a normal write would have had
+                mode = stat.S_IMODE(os.stat(path).st_mode)
+            except FileNotFoundError:
+                mode = 0o644
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        log.info("Saved configuration to %s", path)
     except Exception as e:
-        print(f"Error saving config to {path}: {e}")
-
-# Example of how to use it (optional, modules can call load_config() directly)
-# current_config = load_config()
-
-if __name__ == '__main__':
-    # Test config loading
-    print("--- Testing utils.py ---")
-    # If config.json exists, delete it to test creation, then restore if needed (manual step for user)
-    # For automated test, this section would be more complex.
-    # For now, just load and print.
-    
-    # A simple test: load config and print it.
-    # load_config() will create config.json with defaults if it doesn't exist.
-    cfg = load_config()
-    print("\nLoaded configuration for testing utils.py:")
-    for key, value in cfg.items():
-        print(f"  {key}: {value}")
-    
-    # If config.json was just created, this message is useful.
-    if not os.path.exists(CONFIG_FILE_PATH): # This check is a bit late as load_config creates it.
-                                           # It's more to inform the user that it *would have been* created.
-        print(f"Note: {CONFIG_FILE_PATH} would have been created with default values if it was missing.")
-    else:
-        print(f"Found {CONFIG_FILE_PATH}. Values above are from this file, merged with defaults.")
-    print("--- utils.py test finished ---")
+        log.error("Error saving config to %s: %s", path, e)